@@ -1,8 +1,9 @@
 from fastapi import APIRouter
 
-from app.api.routes import story, feedback
+from app.api.routes import story, feedback, admin
 
 
 api_router = APIRouter()
 api_router.include_router(story.router)
 api_router.include_router(feedback.router)
+api_router.include_router(admin.router)
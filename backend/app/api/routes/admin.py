@@ -0,0 +1,82 @@
+import asyncio
+import csv
+import io
+from datetime import date, datetime, timezone
+from typing import Iterator, Literal, Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from app.core.security import require_admin
+from app.schemas.feedback import FeedbackPage
+from app.schemas.tokens import TokenUsagePage
+from app.services.feedback_store import feedback_store
+from app.services.token_ledger import token_ledger
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(require_admin)])
+
+
+@router.get("/feedback", response_model=FeedbackPage)
+def list_feedback(
+    start: Optional[datetime] = Query(None, description="Only feedback submitted at or after this time"),
+    end: Optional[datetime] = Query(None, description="Only feedback submitted before this time"),
+    q: Optional[str] = Query(None, description="Keywords to search for (full-text search)"),
+    before_id: Optional[int] = Query(None, description="Cursor returned by the previous page"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """ Page through the stored feedback, newest first. """
+    items = feedback_store.query(start, end, q, before_id, limit)
+    next_cursor = items[-1].id if len(items) == limit else None
+    return FeedbackPage(items=items, next_cursor=next_cursor)
+
+
+@router.get("/feedback/export")
+def export_feedback(
+    format: Literal["csv", "ndjson"] = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    q: Optional[str] = None
+):
+    """ Stream all the matching feedback as CSV or NDJSON, without loading it all in memory. """
+    records = feedback_store.iter_all(start, end, q)
+
+    def csv_lines() -> Iterator[str]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["id", "created_at", "email", "message"])
+        for record in records:
+            writer.writerow([record.id, record.created_at.isoformat(), record.email or "", record.message])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def ndjson_lines() -> Iterator[str]:
+        for record in records:
+            yield record.model_dump_json() + "\n"
+
+    if format == "csv":
+        return StreamingResponse(
+            csv_lines(),
+            media_type="text/csv",
+            headers={"Content-Disposition": "attachment; filename=feedback.csv"}
+        )
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=feedback.ndjson"}
+    )
+
+
+@router.get("/tokens", response_model=TokenUsagePage)
+async def token_usage(
+    scope: Literal["story", "client"] = "client",
+    day: Optional[date] = Query(None, description="UTC day, defaults to today"),
+    key: Optional[str] = Query(None, description="Only the usage of this story key or client IP address"),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """ Token usage of a day per story or per client, largest consumers first. """
+    # include the records waiting for the next batch:
+    await token_ledger.flush()
+    day = day or datetime.now(timezone.utc).date()
+    items = await asyncio.to_thread(token_ledger.query, scope, day, key, limit)
+    budget = token_ledger.story_budget if scope == "story" else token_ledger.client_budget
+    return TokenUsagePage(day=day, scope=scope, budget=budget, items=items)
@@ -1,18 +1,79 @@
+import hashlib
 import logging
-from fastapi import APIRouter, HTTPException, status, Request
+import re
+from typing import Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi.responses import FileResponse
+from slowapi.util import get_remote_address
 from app import schemas
-from app.services.story_generator import llm_generate_story, StoryGeneratorException
+from app.services.story_export import MEDIA_TYPES, StoryExportBusyException, StoryExportException, story_exporter
+from app.services.story_generator import llm_generate_story, StoryGeneratorException, StoryStep
+from app.services.token_ledger import TokenBudgetExceededException, story_key, token_ledger
+from app.core.cancellation import run_cancellable, ClientDisconnectedException
+from app.core.config import settings
+from app.core.metrics import metrics
 from app.core.rate_limiter import limiter
+from app.core.serialization import PydanticJSONResponse, json_body, json_body_openapi
+from app.core.single_flight import SingleFlight
+from app.core.tracing import tracer
+from app.workers.story_render import story_title
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/story", tags=["Story endpoints"])
 
+# identical story requests (double-taps, retries, refreshes) share a single LLM call:
+story_flight = SingleFlight("story_generation", grace_period=settings.STORY_DUPLICATE_GRACE_PERIOD)
+
+
+# the body is validated straight from the raw bytes:
+parse_story_request = json_body(schemas.StoryRequest)
+
+
+async def story_request_key(request: Request, story_request: schemas.StoryRequest = Depends(parse_story_request)) -> str:
+    """ Canonical hash of the story request, used to coalesce identical requests. """
+    # re-serializing the validated request normalizes whitespace and field order:
+    key = hashlib.sha256(story_request.__pydantic_serializer__.to_json(story_request)).hexdigest()
+    # keep the key around for the rate limiter, which runs before the endpoint:
+    request.state.story_request_key = key
+    return key
+
+
+def is_duplicate_story_request(request: Request) -> bool:
+    """ Duplicates of a request that is in flight (or just completed) don't consume rate-limit quota. """
+    key = getattr(request.state, "story_request_key", None)
+    return key is not None and story_flight.has(key)
+
+
+async def generate_and_account(story_request: schemas.StoryRequest, client: str, story: Optional[str]) -> StoryStep:
+    """ Generate the next story step and record the tokens it used in the ledger,
+        including the tokens of failed generations, which are billed all the same.
+    """
+    step = None
+    with token_ledger.track() as usage:
+        try:
+            step = await llm_generate_story(story_request)
+            return step
+        finally:
+            if story is None and step is not None:
+                # the story is identified by its first paragraph, which was just generated:
+                story = story_key(story_request.prompt, step.paragraph)
+            token_ledger.record(client, story, step.model if step else None, usage)
+
 
 # we have one endpoint for both starting a new story and continuing an existing one:
-@router.post("/generate")
-@limiter.limit("10/minute")  # Limit to 10 requests per minute per IP
-async def generate_story(request: Request, story_request: schemas.StoryRequest):
+@router.post(
+    "/generate",
+    response_model=schemas.StoryResponse,
+    response_class=PydanticJSONResponse,
+    openapi_extra=json_body_openapi(schemas.StoryRequest)
+)
+@limiter.limit("10/minute", exempt_when=is_duplicate_story_request)  # Limit to 10 requests per minute per IP
+async def generate_story(
+    request: Request,
+    story_request: schemas.StoryRequest = Depends(parse_story_request),
+    request_key: str = Depends(story_request_key)
+):
     """ 
     This endpoint is used to start a new story or continue an existing one:
     - if StoryRequest only contains a seed prompt, it starts a new story
@@ -34,8 +95,44 @@ async def generate_story(request: Request, story_request: schemas.StoryRequest):
             detail="Story history missing."
         )
 
+    client = get_remote_address(request)
+    story = story_key(story_request.prompt, story_request.history[0]) if story_request.history else None
     try:
-        paragraph, choices, stage_plan = await llm_generate_story(story_request)
+        token_ledger.check(client, story, story_request.prompt.length)
+    except TokenBudgetExceededException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(exc)
+        )
+
+    # time spent reading and validating the request body, which grows with the history:
+    request_span = tracer.current_span()
+    request_span.set_attribute("http.time_to_handler_ms", request_span.elapsed_ms())
+
+    try:
+        # cancel the generation if the client goes away or the deadline is reached,
+        # so that we don't keep the LLM busy with answers nobody will read:
+        with tracer.span("story.generate", **{"story.history_length": len(story_request.history)}):
+            step = await run_cancellable(
+                request,
+                story_flight.do(request_key, lambda: generate_and_account(story_request, client, story)),
+                deadline=settings.STORY_REQUEST_DEADLINE,
+                poll_interval=settings.DISCONNECT_POLL_INTERVAL
+            )
+    except ClientDisconnectedException:
+        logger.info("Client disconnected, story generation cancelled")
+        metrics.increment("story_cancelled_client_disconnected")
+        raise HTTPException(
+            status_code=499,    # non-standard "Client Closed Request" status
+            detail="Client closed request."
+        )
+    except TimeoutError:
+        logger.error(f"Story generation exceeded the {settings.STORY_REQUEST_DEADLINE}s deadline")
+        metrics.increment("story_cancelled_deadline")
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Story generation timed out. Please try again."
+        )
     except StoryGeneratorException as exc:
         logger.error(f"Story generation failed: {exc}")
         raise HTTPException(
@@ -44,6 +141,53 @@ async def generate_story(request: Request, story_request: schemas.StoryRequest):
         )
 
     history = story_request.history
-    history.append(paragraph)
+    history.append(step.paragraph)
     
-    return schemas.StoryResponse(history=history, choices=choices, stage_plan=stage_plan)
+    return PydanticJSONResponse(
+        schemas.StoryResponse(history=history, choices=step.choices, stage_plan=step.stage_plan),
+        # let clients (and logs) know which model tier served the response:
+        headers={"X-Model-Tier": step.model}
+    )
+
+
+parse_export_request = json_body(schemas.StoryExportRequest)
+
+
+@router.post(
+    "/export",
+    response_class=FileResponse,
+    responses={200: {"content": {media_type: {} for media_type in MEDIA_TYPES.values()}}},
+    openapi_extra=json_body_openapi(schemas.StoryExportRequest)
+)
+@limiter.limit("10/minute")
+async def export_story(
+    request: Request,
+    format: Literal["pdf", "epub"] = Query("pdf", description="Format of the exported file"),
+    story: schemas.StoryExportRequest = Depends(parse_export_request)
+):
+    """ Render a finished story (title, characters and paragraphs) to a PDF or EPUB file. """
+    if len(story.history) < story.prompt.length:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Story not finished."
+        )
+
+    try:
+        with tracer.span("story.export", **{"export.format": format, "story.history_length": len(story.history)}):
+            path = await story_exporter.export(story, format)
+    except StoryExportBusyException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(exc)
+        )
+    except StoryExportException as exc:
+        logger.error(f"Story export failed: {exc}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=str(exc)
+        )
+
+    # the title without the characters that aren't allowed in file names:
+    filename = re.sub(r'[\\/:*?"<>|]+', "", story_title(story)).strip() or "story"
+    # the file is sent from the cache, PDF and EPUB files are already compressed so the middleware leaves them as is:
+    return FileResponse(path, media_type=MEDIA_TYPES[format], filename=f"{filename}.{format}")
@@ -0,0 +1,39 @@
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+TOO_LARGE_DETAIL = "Request body too large."
+
+
+class BodySizeLimitMiddleware:
+    """ ASGI middleware rejecting request bodies larger than `max_body_size` bytes with a 413.
+        The limit is enforced while the body is received, before it's buffered: upfront from
+        the Content-Length header, and chunk by chunk for chunked requests.
+    """
+    def __init__(self, app, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse({"detail": TOO_LARGE_DETAIL}, status_code=status.HTTP_413_CONTENT_TOO_LARGE)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def receive_wrapper():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # raised where the body is read (eg: `await request.body()`),
+                    # and turned into a 413 response by the exception middleware:
+                    raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE, detail=TOO_LARGE_DETAIL)
+            return message
+
+        await self.app(scope, receive_wrapper, send)
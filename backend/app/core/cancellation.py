@@ -0,0 +1,42 @@
+import asyncio
+from contextlib import suppress
+from typing import Awaitable, TypeVar
+from fastapi import Request
+
+T = TypeVar("T")
+
+
+class ClientDisconnectedException(Exception):
+    pass
+
+
+async def _wait_for_disconnect(request: Request, poll_interval: float):
+    while not await request.is_disconnected():
+        await asyncio.sleep(poll_interval)
+
+
+async def run_cancellable(request: Request, coro: Awaitable[T], deadline: float, poll_interval: float) -> T:
+    """ Await `coro` while watching the client connection.
+        The work is cancelled if the client disconnects (raises ClientDisconnectedException)
+        or if it doesn't complete within `deadline` seconds (raises TimeoutError).
+    """
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.create_task(_wait_for_disconnect(request, poll_interval))
+    try:
+        done, _ = await asyncio.wait(
+            {task, watcher},
+            timeout=deadline,
+            return_when=asyncio.FIRST_COMPLETED
+        )
+        if task in done:
+            return task.result()
+        if watcher in done:
+            raise ClientDisconnectedException("Client disconnected before the response was ready")
+        raise TimeoutError(f"Request did not complete within {deadline} seconds")
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # wait for the cancelled work to unwind (closing upstream connections etc):
+            with suppress(asyncio.CancelledError, Exception):
+                await task
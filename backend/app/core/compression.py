@@ -0,0 +1,80 @@
+import gzip
+from typing import List, Optional
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+# media types which are already compressed, compressing them again only costs CPU:
+COMPRESSED_MEDIA_TYPES = (
+    "application/pdf", "application/epub+zip", "application/zip", "application/gzip", "image/", "audio/", "video/"
+)
+
+
+def is_compressed_media_type(content_type: str) -> bool:
+    media_type = content_type.split(";")[0].strip().lower()
+    return media_type != "image/svg+xml" and media_type.startswith(COMPRESSED_MEDIA_TYPES)
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    return gzip.compress(body, compresslevel=gzip_level)
+
+
+class CompressionMiddleware:
+    """ ASGI middleware compressing responses larger than `minimum_size` with the first of
+        `encodings` (eg: ["br", "gzip"]) accepted by the client.
+        Streamed responses, partial responses (whose ranges refer to the uncompressed body)
+        and responses which are already encoded or compressed are sent as is.
+    """
+    def __init__(self, app, encodings: List[str], minimum_size: int = 1024,
+                 gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.encodings = [encoding for encoding in encodings if encoding in ("br", "gzip")]
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def _pick_encoding(self, accept_encoding: str) -> Optional[str]:
+        accepted = {value.split(";")[0].strip() for value in accept_encoding.lower().split(",")}
+        return next((encoding for encoding in self.encodings if encoding in accepted), None)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = self._pick_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # hold the headers until we know the size of the body:
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or start_message is None:
+                return await send(message)
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or start_message["status"] == 206
+                or "content-range" in headers
+                or is_compressed_media_type(headers.get("content-type", ""))
+            ):
+                await send(start_message)
+            else:
+                body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+                await send({**start_message, "headers": headers.raw})
+                message = {**message, "body": body}
+            start_message = None
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -1,7 +1,13 @@
-from pydantic import ConfigDict
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict
 from pydantic_settings import BaseSettings
 
 
+class ModelTier(BaseModel):
+    model: str
+    latency_slo: float  # p95 latency target (in seconds) of the model
+
+
 class Settings(BaseSettings):
     LLM_METHOD: str = "openai"
     
@@ -13,12 +19,77 @@ class Settings(BaseSettings):
     LLM_OLLAMA_API_URL: str = "http://localhost:11434/api/generate"
     
     LLM_HUGGINGFACE_MODEL: str = "OpenLLM-France/Claire-Mistral-7B-0.1"
+    LLM_HUGGINGFACE_WORKERS: int = 1                # number of inference worker processes
+    LLM_HUGGINGFACE_SHARE_WEIGHTS: bool = False     # load the model once and share it between workers (CPU only, ignored with a GPU)
+    # Small model of the same family (sharing the tokenizer) enabling assisted decoding:
+    # it proposes tokens that the main model verifies in batches
+    LLM_HUGGINGFACE_DRAFT_MODEL: Optional[str] = None
+    LLM_HUGGINGFACE_ASSISTED_PROBE_RATE: float = 0.05   # ratio of requests decoded without the draft model, to measure the speedup
+    
+    LLM_MAX_OUTPUT_TOKENS: int = 600    # upper bound of the adaptive output token budget
+    
+    # Model tiers, ordered from the preferred model to the fastest one, as a JSON list, eg:
+    # [{"model": "meta-llama/llama-4-maverick-17b-128e-instruct", "latency_slo": 6}, {"model": "llama-3.1-8b-instant", "latency_slo": 3}]
+    # Under load we switch to the next tier. Defaults to the single LLM_OPENAI_MODEL / LLM_OLLAMA_MODEL.
+    LLM_OPENAI_MODEL_TIERS: List[ModelTier] = []
+    LLM_OLLAMA_MODEL_TIERS: List[ModelTier] = []
+    LLM_TIER_MAX_IN_FLIGHT: int = 8         # in-flight LLM calls above which we switch to a faster tier
+    LLM_TIER_RECOVERY_RATIO: float = 0.7    # switch back once latency and load are below this ratio of the limits
+    LLM_TIER_MIN_DWELL: float = 60.0        # min time (in seconds) between two tier switches
+    LLM_TIER_LATENCY_WINDOW: int = 50       # number of recent calls used to compute the p95 latency
+    
+    # Split generation: the main model only writes the paragraph, and a small fast model
+    # writes the choices (started while the end of the paragraph is still being streamed)
+    STORY_SPLIT_GENERATION: bool = False
+    LLM_CHOICES_METHOD: str = "openai"                  # openai, ollama or huggingface
+    LLM_CHOICES_MODEL: str = "llama-3.1-8b-instant"
+    LLM_CHOICES_MAX_TOKENS: int = 80
+    
     CORS_ORIGINS: str = "http://localhost:3000"
     
+    MAX_REQUEST_BODY_SIZE: int = 1_000_000      # in bytes, larger request bodies are rejected with a 413
+    # Response compression, by order of preference, empty to disable:
+    RESPONSE_COMPRESSION: List[str] = ["br", "gzip"]
+    RESPONSE_COMPRESSION_MIN_SIZE: int = 1024   # in bytes, smaller responses aren't worth compressing
+    RESPONSE_GZIP_LEVEL: int = 6
+    RESPONSE_BROTLI_QUALITY: int = 4            # 0-11, higher levels are too slow for dynamic responses
+    
+    # Key to pass in the X-Admin-Key header to access admin-only features (disabled if not set)
+    ADMIN_API_KEY: Optional[str] = None
+    
+    # Tracing settings, spans are exported in the OpenTelemetry (OTLP/JSON) format
+    TRACING_ENABLED: bool = False
+    TRACING_EXPORT_FILE: Optional[str] = "traces.otlp.jsonl"   # file to append the spans to
+    TRACING_OTLP_ENDPOINT: Optional[str] = None                # OTLP/HTTP collector, eg: http://localhost:4318
+    
+    # Request cancellation settings
+    STORY_REQUEST_DEADLINE: float = 60.0    # overall deadline (in seconds) to generate a story step
+    DISCONNECT_POLL_INTERVAL: float = 0.5   # how often (in seconds) to check if the client went away
+    
+    # How long (in seconds) the result of a story request is kept to answer identical retries:
+    STORY_DUPLICATE_GRACE_PERIOD: float = 10.0
+    
+    # Story export (PDF/EPUB) settings
+    STORY_EXPORT_WORKERS: int = 2               # number of rendering processes
+    STORY_EXPORT_MAX_PENDING: int = 20          # renderings queued or running above which new exports are refused
+    STORY_EXPORT_CACHE_DIR: str = "data/exports"
+    STORY_EXPORT_CACHE_MAX_SIZE: int = 500_000_000  # in bytes, least recently used exports are deleted above that
+    
+    # Token accounting settings, budgets are in tokens (prompt + completion) per UTC day, 0 to disable them
+    TOKEN_BUDGET_PER_STORY: int = 600_000       # for a 60 paragraphs story (~400k tokens at 12 y.o.), scaled down for shorter ones
+    TOKEN_BUDGET_PER_CLIENT: int = 5_000_000    # per IP address, shared by everyone behind it (eg: a school or a family)
+    TOKEN_LEDGER_DB_PATH: str = "data/tokens.db"    # local SQLite database where the token usage is stored
+    TOKEN_LEDGER_WRITE_BATCH_SIZE: int = 500
+    TOKEN_LEDGER_WRITE_INTERVAL: float = 5.0        # max time (in seconds) usage records wait before being written
+    TOKEN_LEDGER_RETENTION_DAYS: int = 30           # per-request records are deleted after that, daily totals are kept
+    
     # Feedback settings
     SENDGRID_API_KEY: str
     FEEDBACK_EMAIL_TO: str      # email where feedback will be sent
     FEEDBACK_EMAIL_FROM: str    # Verified sender email for SendGrid
+    FEEDBACK_DB_PATH: str = "data/feedback.db"  # local SQLite database where all feedback is stored
+    FEEDBACK_WRITE_BATCH_SIZE: int = 100
+    FEEDBACK_WRITE_INTERVAL: float = 1.0        # max time (in seconds) feedback waits before being written
 
     model_config = ConfigDict(env_file=".env", env_file_encoding="utf-8")
     
@@ -0,0 +1,39 @@
+import threading
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """ Minimal in-process metrics registry.
+        Counters and gauges live in memory only, so they are reset when the process restarts.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+
+    def increment(self, name: str, value: int = 1):
+        """ Increment the counter `name` by `value`. """
+        with self._lock:
+            self._counters[name] += value
+
+    def set(self, name: str, value: float):
+        """ Set the gauge `name` to `value`. """
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name: str) -> float:
+        """ Return the current value of the counter or gauge `name`. """
+        with self._lock:
+            if name in self._gauges:
+                return self._gauges[name]
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """ Return a copy of all the counters and gauges. """
+        with self._lock:
+            return {**self._counters, **self._gauges}
+
+
+# Global instance
+metrics = Metrics()
@@ -0,0 +1,105 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.datastructures import Headers
+from app.core.security import is_admin_key
+
+
+class SamplingProfiler:
+    """ Statistical profiler sampling the stacks of every thread at a fixed interval.
+        The report uses the collapsed stack format (one `frame;frame;frame count` line
+        per distinct stack), which flamegraph.pl or speedscope can render directly.
+    """
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.sample_count = 0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_time = 0.0
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start_time
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(thread_names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def report(self, top: int = 20) -> str:
+        """ Return the profile as text: the functions with the most samples, then the collapsed stacks. """
+        self_samples = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack.rsplit(";", 1)[-1]] += count
+
+        lines = [
+            f"# {self.duration * 1000:.1f} ms, {self.sample_count} samples "
+            f"every {self.interval * 1000:g} ms across all threads",
+            f"# top {top} functions by self samples:",
+        ]
+        lines += [f"#   {count:6d}  {function}" for function, count in self_samples.most_common(top)]
+        lines.append("# collapsed stacks:")
+        lines += [f"{stack} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+
+class ProfilingMiddleware:
+    """ ASGI middleware profiling a single request when an admin sends the `X-Profile: 1` header.
+        The profile report is returned instead of the response, whose status code
+        is kept in the `X-Profiled-Status` header.
+    """
+    def __init__(self, app, interval: float = 0.005):
+        self.app = app
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = Headers(scope=scope)
+        if headers.get("x-profile", "").lower() not in ("1", "true"):
+            return await self.app(scope, receive, send)
+
+        if not is_admin_key(headers.get("x-admin-key")):
+            response = JSONResponse({"detail": "Profiling requires a valid admin key."}, status_code=403)
+            return await response(scope, receive, send)
+
+        status_code = None
+
+        async def send_wrapper(message):
+            # the original response is discarded, only its status code is kept:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+        profiler = SamplingProfiler(self.interval)
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop()
+
+        response = PlainTextResponse(profiler.report(), headers={"X-Profiled-Status": str(status_code)})
+        await response(scope, receive, send)
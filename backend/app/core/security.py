@@ -0,0 +1,20 @@
+import secrets
+from typing import Optional
+from fastapi import Header, HTTPException, status
+from app.core.config import settings
+
+
+def is_admin_key(key: Optional[str]) -> bool:
+    """ Check the given key against the configured admin key (admin access is disabled if it isn't set). """
+    if not settings.ADMIN_API_KEY or not key:
+        return False
+    return secrets.compare_digest(key, settings.ADMIN_API_KEY)
+
+
+async def require_admin(x_admin_key: Optional[str] = Header(None)):
+    """ Dependency restricting an endpoint to admins. """
+    if not is_admin_key(x_admin_key):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required."
+        )
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Tuple, TypeVar
+from app.core.metrics import metrics
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """ Coalesce concurrent calls sharing the same key into a single execution.
+
+        Callers whose key is already in flight await the same task instead of
+        starting their own, and successful results are kept for `grace_period`
+        seconds so that immediate retries are answered instantly.
+        The shared task is only cancelled once every caller waiting on it went away.
+    """
+    def __init__(self, name: str, grace_period: float):
+        self.name = name
+        self.grace_period = grace_period
+        self._in_flight: Dict[str, _Flight] = {}
+        self._results: Dict[str, Tuple[float, Any]] = {}    # key -> (expiry time, result)
+
+    def has(self, key: str) -> bool:
+        """ Whether a call for `key` is in flight or has a result in the grace window. """
+        self._evict_expired()
+        return key in self._in_flight or key in self._results
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """ Return the result of `fn()`, sharing it with every concurrent call for `key`. """
+        self._evict_expired()
+        if key in self._results:
+            metrics.increment(f"{self.name}_grace_hits")
+            metrics.increment(f"{self.name}_calls_saved")
+            return self._results[key][1]
+
+        flight = self._in_flight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda task: self._on_done(key, flight))
+        else:
+            metrics.increment(f"{self.name}_coalesced")
+            metrics.increment(f"{self.name}_calls_saved")
+
+        flight.waiters += 1
+        try:
+            # shield the shared task so that one caller going away doesn't cancel it for everyone:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # every caller went away, nobody needs the result anymore:
+                flight.task.cancel()
+
+    def _on_done(self, key: str, flight: _Flight):
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+        if flight.task.cancelled() or flight.task.exception() is not None:
+            return
+        if self.grace_period > 0:
+            self._results[key] = (time.monotonic() + self.grace_period, flight.task.result())
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, (expiry, _) in self._results.items() if expiry <= now]
+        for key in expired:
+            del self._results[key]
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+import httpx
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """ A timed operation, part of a trace. Exported in the OpenTelemetry (OTLP/JSON) format. """
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def elapsed_ms(self) -> float:
+        return (time.time_ns() - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 2 if self.parent_id is None else 1,     # SERVER for the root span, INTERNAL otherwise
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """ Span used when tracing is disabled. """
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def elapsed_ms(self) -> float:
+        return 0.0
+
+
+def _otlp_attribute(key: str, value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class BatchSpanExporter:
+    """ Exports finished spans in batches from a background thread, so that
+        request handling never waits on the file system or the collector.
+        Spans are written as OTLP/JSON lines to a file and/or posted to an
+        OTLP/HTTP collector (`<endpoint>/v1/traces`).
+    """
+    def __init__(self, service_name: str, file_path: Optional[str], otlp_endpoint: Optional[str],
+                 batch_size: int = 64, flush_interval: float = 2.0):
+        self.service_name = service_name
+        self.file_path = file_path
+        self.otlp_endpoint = otlp_endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def export(self, span: Span):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self._thread.start()
+        self._queue.put(span)
+
+    def shutdown(self):
+        """ Flush the pending spans and stop the export thread. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        batch: List[Span] = []
+        running = True
+        while running:
+            try:
+                span = self._queue.get(timeout=self.flush_interval)
+                if span is None:
+                    running = False
+                else:
+                    batch.append(span)
+                    if len(batch) < self.batch_size:
+                        continue
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+                batch = []
+
+    def _write(self, spans: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "talehopper"},
+                    "spans": [span.to_otlp() for span in spans]
+                }]
+            }]
+        }
+        try:
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(payload) + "\n")
+            if self.otlp_endpoint:
+                httpx.post(f"{self.otlp_endpoint.rstrip('/')}/v1/traces", json=payload, timeout=5).raise_for_status()
+        except (OSError, httpx.HTTPError) as exc:
+            logger.warning(f"Failed to export {len(spans)} spans: {str(exc)}")
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """ Lightweight in-process tracer, spans are nested through a context variable
+        so they follow the request across awaits, tasks and `asyncio.to_thread`.
+    """
+    def __init__(self, enabled: bool, exporter: BatchSpanExporter):
+        self.enabled = enabled
+        self.exporter = exporter
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if not self.enabled:
+            yield _NoopSpan()
+            return
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.error = f"{type(exc).__name__}: {str(exc)}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            self.exporter.export(span)
+
+    def current_span(self):
+        """ Return the active span (or a no-op span outside of any trace). """
+        return _current_span.get() or _NoopSpan()
+
+    def shutdown(self):
+        self.exporter.shutdown()
+
+
+class TracingMiddleware:
+    """ ASGI middleware creating the root span of each HTTP request. """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled or scope["path"] == "/health":
+            return await self.app(scope, receive, send)
+
+        with tracer.span(f"{scope['method']} {scope['path']}", **{
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        }) as span:
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.status_code", message["status"])
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+# Global instance
+tracer = Tracer(
+    enabled=settings.TRACING_ENABLED,
+    exporter=BatchSpanExporter(
+        service_name="talehopper-backend",
+        file_path=settings.TRACING_EXPORT_FILE,
+        otlp_endpoint=settings.TRACING_OTLP_ENDPOINT
+    )
+)
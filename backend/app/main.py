@@ -4,9 +4,18 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from slowapi.errors import RateLimitExceeded
 from app.api.main import api_router
 from app.services import story_generator
+from app.services.feedback_store import feedback_store
+from app.services.story_export import story_exporter
+from app.services.token_ledger import token_ledger
+from app.core.body_limit import BodySizeLimitMiddleware
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.profiling import ProfilingMiddleware
+from app.core.tracing import tracer, TracingMiddleware
 from app.core.rate_limiter import limiter, rate_limit_handler
 
 
@@ -29,16 +38,37 @@ async def lifespan(app: FastAPI):
         is shutting down (potential cleanup steps).
     """
     story_generator.initialize()
+    await feedback_store.start()
+    await token_ledger.start()
+    story_exporter.start()
     yield
     # do cleanup here if necessary
+    story_exporter.stop()
+    await token_ledger.stop()
+    await feedback_store.stop()
+    story_generator.shutdown()
+    tracer.shutdown()
 
 
 app = FastAPI(lifespan=lifespan)
 
-# Set up a rate limiter:
+# Set up a rate limiter (the handler only catches its errors, other 429 responses keep their detail):
 app.state.limiter = limiter
-app.add_exception_handler(429, rate_limit_handler)
+app.add_exception_handler(RateLimitExceeded, rate_limit_handler)
 
+# Reject oversized request bodies before they're buffered, and compress large responses:
+app.add_middleware(BodySizeLimitMiddleware, max_body_size=settings.MAX_REQUEST_BODY_SIZE)
+app.add_middleware(
+    CompressionMiddleware,
+    encodings=settings.RESPONSE_COMPRESSION,
+    minimum_size=settings.RESPONSE_COMPRESSION_MIN_SIZE,
+    gzip_level=settings.RESPONSE_GZIP_LEVEL,
+    brotli_quality=settings.RESPONSE_BROTLI_QUALITY
+)
+
+# Request tracing and on-demand profiling:
+app.add_middleware(TracingMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 # Enable CORS
 cors_origins = settings.CORS_ORIGINS.split(",") if settings.CORS_ORIGINS else ["*"]
@@ -59,3 +89,7 @@ async def root():
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/metrics")
+def get_metrics():
+    return metrics.snapshot()
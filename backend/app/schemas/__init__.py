@@ -1 +1 @@
-from .story import StoryRequest, StoryResponse, StoryPrompt
\ No newline at end of file
+from .story import StoryRequest, StoryResponse, StoryPrompt, StoryExportRequest
\ No newline at end of file
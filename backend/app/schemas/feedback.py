@@ -1,5 +1,6 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 
 class FeedbackRequest(BaseModel):
@@ -12,3 +13,16 @@ class FeedbackRequest(BaseModel):
 class FeedbackResponse(BaseModel):
     success: bool
     message: str
+
+
+class FeedbackRecord(BaseModel):
+    id: int
+    created_at: datetime
+    email: Optional[str] = None
+    message: str
+
+
+class FeedbackPage(BaseModel):
+    items: List[FeedbackRecord]
+    # pass as `before_id` to get the next page, None on the last page:
+    next_cursor: Optional[int] = None
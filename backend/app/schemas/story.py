@@ -34,4 +34,10 @@ class StoryRequest(BaseModel):
 class StoryResponse(BaseModel):
     choices: List[str] = Field(..., description="List of options for the next step of the story")
     history: List[str] = Field(..., description="Ordered list of all story steps up to this point")
-    stage_plan: Dict[str, int] = Field(..., description="Number of steps for each stage in the story")
\ No newline at end of file
+    stage_plan: Dict[str, int] = Field(..., description="Number of steps for each stage in the story")
+
+
+class StoryExportRequest(BaseModel):
+    prompt: StoryPrompt
+    history: List[str] = Field(..., min_length=1, description="All the paragraphs of the finished story")
+    title: Optional[str] = Field(None, max_length=200, description="Title of the story (defaults to the characters' names)")
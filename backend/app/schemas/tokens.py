@@ -0,0 +1,18 @@
+from datetime import date
+from pydantic import BaseModel
+from typing import List, Literal
+
+
+class TokenUsageRecord(BaseModel):
+    key: str    # story key or client IP address
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+    requests: int
+
+
+class TokenUsagePage(BaseModel):
+    day: date
+    scope: Literal["story", "client"]
+    budget: int     # daily token budget of each client, or of a 60 paragraphs story (0 if unlimited)
+    items: List[TokenUsageRecord]
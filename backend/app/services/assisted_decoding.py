@@ -0,0 +1,64 @@
+import random
+import threading
+from collections import deque
+from typing import Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+class AssistedDecodingMonitor:
+    """ Decides which local generations use the draft model (assisted decoding) and tracks
+        how well it works: the ratio of draft tokens accepted by the main model, and the
+        speedup in tokens/sec over plain decoding. A small ratio of requests (`probe_rate`)
+        is decoded without the draft model so that the speedup is measured on live traffic.
+    """
+    def __init__(self, draft_model: Optional[str], probe_rate: float, window: int = 50):
+        self.draft_model = draft_model or None
+        self.probe_rate = probe_rate
+        self._lock = threading.Lock()
+        # recent decoding throughputs (in tokens/sec) with and without the draft model:
+        self._throughputs = {True: deque(maxlen=window), False: deque(maxlen=window)}
+
+    def pick_draft_model(self) -> Optional[str]:
+        """ Return the draft model to use for the next generation (None for plain decoding). """
+        if self.draft_model and random.random() >= self.probe_rate:
+            return self.draft_model
+        return None
+
+    def observe(self, result: dict):
+        """ Record the statistics of a generation returned by an inference worker. """
+        tokens = result["completion_tokens"]
+        if tokens == 0 or result["cancelled"] or result["decode_ms"] <= 0:
+            return
+        assisted = result["assisted"]
+        with self._lock:
+            self._throughputs[assisted].append(tokens / (result["decode_ms"] / 1000))
+            speedup = self.speedup()
+
+        if assisted:
+            # each forward pass of the main model accepts some draft tokens, plus one token of its own:
+            accepted = max(0, tokens - result["main_model_steps"])
+            metrics.increment("hf_assisted_generations")
+            metrics.increment("hf_draft_tokens_proposed", result["draft_tokens"])
+            metrics.increment("hf_draft_tokens_accepted", accepted)
+            proposed = metrics.get("hf_draft_tokens_proposed")
+            if proposed:
+                metrics.set("hf_draft_acceptance_rate", round(metrics.get("hf_draft_tokens_accepted") / proposed, 3))
+        else:
+            metrics.increment("hf_plain_generations")
+        if speedup is not None:
+            metrics.set("hf_assisted_speedup", round(speedup, 2))
+
+    def speedup(self) -> Optional[float]:
+        """ Mean assisted over mean plain decoding throughput, None until both were observed. """
+        assisted, plain = self._throughputs[True], self._throughputs[False]
+        if not assisted or not plain:
+            return None
+        return (sum(assisted) / len(assisted)) / (sum(plain) / len(plain))
+
+
+# Global instance
+assisted_decoding = AssistedDecodingMonitor(
+    settings.LLM_HUGGINGFACE_DRAFT_MODEL,
+    probe_rate=settings.LLM_HUGGINGFACE_ASSISTED_PROBE_RATE
+)
@@ -4,6 +4,7 @@ from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 from app.core.config import settings
 from app.schemas.feedback import FeedbackRequest
+from app.services.feedback_store import feedback_store
 
 logger = logging.getLogger(__name__)
 
@@ -16,9 +17,11 @@ class FeedbackService:
     
     async def send_feedback_email(self, feedback: FeedbackRequest) -> bool:
         """ Send feedback email via SendGrid """
+        # every feedback is kept in the local store, whether or not it's also sent by email:
+        feedback_store.add(feedback)
+        
         if not self.sendgrid_client:
-            logger.warning("SendGrid not configured - feedback will be logged only")
-            self._log_feedback(feedback)
+            logger.warning("SendGrid not configured - feedback will be stored locally only")
             return True
         
         if not settings.FEEDBACK_EMAIL_TO or not settings.FEEDBACK_EMAIL_FROM:
@@ -51,8 +54,6 @@ class FeedbackService:
                 
         except Exception as exc:
             logger.error(f"Error sending feedback email: {str(exc)}")
-            # Still log the feedback even if email fails
-            self._log_feedback(feedback)
             return False
     
     def _format_email_body(self, feedback: FeedbackRequest) -> str:
@@ -83,17 +84,6 @@ class FeedbackService:
         """
         
         return html_content
-    
-    def _log_feedback(self, feedback: FeedbackRequest):
-        """Log feedback to console/logs when email is not available"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S UTC")
-        logger.info(f"""
-        === NEW FEEDBACK RECEIVED ===
-        Timestamp: {timestamp}
-        User Email: {feedback.email if feedback.email else 'Not provided'}
-        Message: {feedback.message}
-        ============================
-        """)
 
 
 # Global instance
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.schemas.feedback import FeedbackRecord, FeedbackRequest
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feedback (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    email TEXT,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_feedback_created_at ON feedback(created_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS feedback_fts USING fts5(
+    message, email, content='feedback', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS feedback_fts_insert AFTER INSERT ON feedback BEGIN
+    INSERT INTO feedback_fts(rowid, message, email) VALUES (new.id, new.message, new.email);
+END;
+"""
+
+
+def _fts_query(keywords: str) -> str:
+    """ Turn user keywords into an FTS5 query matching all of them, quoting each
+        keyword so that FTS5 operators and punctuation can't break the query.
+    """
+    return " ".join('"' + keyword.replace('"', '""') + '"' for keyword in keywords.split())
+
+
+class FeedbackStore:
+    """ Local feedback storage in an embedded SQLite database (WAL mode).
+
+        Feedback is queued in memory and written in batches by a background task,
+        so submitting feedback never waits on the disk. Queries read through their
+        own connections, which WAL mode lets run alongside the writer.
+    """
+    def __init__(self, db_path: str, batch_size: int, flush_interval: float):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    async def start(self):
+        """ Create the database if needed and start the background writer. """
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+        self._writer = asyncio.create_task(self._run_writer())
+        self._writer.add_done_callback(self._on_writer_done)
+
+    async def stop(self):
+        """ Flush the pending feedback and stop the background writer. """
+        if self._writer is not None:
+            await self._queue.put(None)
+            await self._writer
+            self._writer = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def add(self, feedback: FeedbackRequest):
+        """ Queue the feedback to be written in the next batch. """
+        self._queue.put_nowait((time.time(), feedback.email, feedback.message))
+
+    async def _run_writer(self):
+        running = True
+        while running:
+            batch = []
+            item = await self._queue.get()
+            # collect more feedback for up to `flush_interval` seconds to write them at once:
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout=max(0, deadline - time.monotonic()))
+                except TimeoutError:
+                    break
+            running = item is not None
+            if batch:
+                try:
+                    await asyncio.to_thread(self._write_batch, batch)
+                except Exception as exc:
+                    # never let a bad batch kill the writer, the next ones may be fine:
+                    # without the entries themselves, which hold emails and messages:
+                    logger.error(f"Failed to store {len(batch)} feedback entries: {str(exc)}")
+
+    def _on_writer_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Feedback writer died, feedback won't be stored anymore: {str(task.exception())}")
+
+    def _write_batch(self, batch: List[Tuple[float, Optional[str], str]]):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO feedback (created_at, email, message) VALUES (?, ?, ?)",
+                batch
+            )
+        logger.info(f"Stored {len(batch)} feedback entries")
+
+    def query(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        keywords: Optional[str] = None,
+        before_id: Optional[int] = None,
+        limit: int = 50
+    ) -> List[FeedbackRecord]:
+        """ Return feedback matching the filters, newest first.
+            Pages are chained by passing the id of the last record as `before_id`.
+        """
+        sql = "SELECT f.id, f.created_at, f.email, f.message FROM feedback f"
+        conditions, params = [], []
+        if keywords and keywords.strip():
+            sql += " JOIN feedback_fts ON feedback_fts.rowid = f.id"
+            conditions.append("feedback_fts MATCH ?")
+            params.append(_fts_query(keywords))
+        if start is not None:
+            conditions.append("f.created_at >= ?")
+            params.append(start.timestamp())
+        if end is not None:
+            conditions.append("f.created_at < ?")
+            params.append(end.timestamp())
+        if before_id is not None:
+            conditions.append("f.id < ?")
+            params.append(before_id)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY f.id DESC LIMIT ?"
+        params.append(limit)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+        return [
+            FeedbackRecord(
+                id=row[0],
+                created_at=datetime.fromtimestamp(row[1], tz=timezone.utc),
+                email=row[2],
+                message=row[3]
+            )
+            for row in rows
+        ]
+
+    def iter_all(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        keywords: Optional[str] = None,
+        page_size: int = 500
+    ) -> Iterator[FeedbackRecord]:
+        """ Iterate over all the matching feedback page by page, in constant memory. """
+        before_id = None
+        while True:
+            page = self.query(start, end, keywords, before_id, page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            before_id = page[-1].id
+
+
+# Global instance
+feedback_store = FeedbackStore(
+    db_path=settings.FEEDBACK_DB_PATH,
+    batch_size=settings.FEEDBACK_WRITE_BATCH_SIZE,
+    flush_interval=settings.FEEDBACK_WRITE_INTERVAL
+)
@@ -0,0 +1,170 @@
+import logging
+import math
+import threading
+from typing import Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas import StoryPrompt
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """ Rough token count of `text`, ~4 characters per token for english/french prose. """
+    return max(1, math.ceil(len(text) / 4))
+
+
+class JsonObjectTracker:
+    """ Incrementally tracks the nesting of a streamed JSON value, to detect the moment
+        the top-level object (or array) is closed and stop decoding right there.
+        Anything emitted before the opening brace (markdown fences, chatter) is skipped.
+    """
+    def __init__(self):
+        self.start: Optional[int] = None    # index of the opening brace in the fed text
+        self.end: Optional[int] = None      # index just after the closing brace
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._offset = 0
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, text: str) -> bool:
+        """ Feed the next chunk of text, return True once the top-level value is complete. """
+        if self.complete:
+            return True
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char in "{[":
+                if self.start is None:
+                    self.start = self._offset + i
+                self._depth += 1
+            elif self.start is None:
+                continue
+            elif char == '"':
+                self._in_string = True
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = self._offset + i + 1
+                    return True
+        self._offset += len(text)
+        return False
+
+    def extract(self, text: str) -> str:
+        """ Return the JSON value out of the full fed `text` (or `text` as is if it never completed). """
+        if not self.complete:
+            return text
+        return text[self.start:self.end]
+
+
+class _RunningStats:
+    """ Welford's online mean/variance. """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+class GenerationBudgetController:
+    """ Derives the max number of output tokens for a story step from the child's age,
+        the story stage and the paragraph lengths observed so far (in this story first,
+        then across all stories for the same age group).
+    """
+    # expected paragraph length (in tokens) before we've observed anything:
+    AGE_PRIOR_TOKENS = [(4, 80), (8, 140), (12, 200)]
+    # the climax and resolution usually run a bit longer than the other stages:
+    STAGE_FACTORS = {"Climax": 1.2, "Resolution": 1.2}
+    CHOICES_TOKENS = 60     # 2-3 short choices
+    JSON_OVERHEAD_TOKENS = 20
+    MIN_SAMPLES = 5         # observations needed before trusting the age group statistics
+    MIN_STORY_SAMPLES = 4   # paragraphs needed before trusting the story's own statistics
+    # the budget is a hard cut, a paragraph running longer than expected must still fit:
+    HEADROOM = 1.5
+    FLOOR_RATIO = 0.5       # the expected length never goes below this ratio of the age prior
+    MIN_TOKENS = 64
+
+    def __init__(self, max_tokens_cap: int):
+        self.max_tokens_cap = max_tokens_cap
+        self._lock = threading.Lock()
+        self._stats: Dict[int, _RunningStats] = {}
+
+    def _age_group(self, age: int) -> int:
+        for max_age, _ in self.AGE_PRIOR_TOKENS:
+            if age <= max_age:
+                return max_age
+        return self.AGE_PRIOR_TOKENS[-1][0]
+
+    def _expected_paragraph_tokens(self, age: int, history: List[str]) -> float:
+        prior = dict(self.AGE_PRIOR_TOKENS)[self._age_group(age)]
+        # a few paragraphs of similar lengths have a std close to 0, hence the floor:
+        floor = prior * self.FLOOR_RATIO
+        story_stats = _RunningStats()
+        for paragraph in history:
+            story_stats.add(estimate_tokens(paragraph))
+        if story_stats.count >= self.MIN_STORY_SAMPLES:
+            return max(floor, story_stats.mean + 2 * story_stats.std)
+
+        with self._lock:
+            age_stats = self._stats.get(self._age_group(age))
+            if age_stats and age_stats.count >= self.MIN_SAMPLES:
+                return max(floor, age_stats.mean + 2 * age_stats.std)
+        return prior
+
+    def expected_paragraph_tokens(self, prompt: StoryPrompt, history: List[str], stage: str) -> float:
+        """ Return the (upper bound of the) expected length in tokens of the next paragraph. """
+        paragraph_tokens = self._expected_paragraph_tokens(prompt.age, history)
+        return paragraph_tokens * self.STAGE_FACTORS.get(stage, 1.0)
+
+    def max_tokens_for(self, prompt: StoryPrompt, history: List[str], stage: str, with_choices: bool = True) -> int:
+        """ Return the output token budget for the next step of the story
+            (`with_choices` False when the choices are generated separately).
+        """
+        paragraph_tokens = self.expected_paragraph_tokens(prompt, history, stage)
+        # the last paragraph of the story has no choices:
+        choices_tokens = self.CHOICES_TOKENS if with_choices and len(history) < prompt.length - 1 else 0
+        budget = int((paragraph_tokens + choices_tokens) * self.HEADROOM + self.JSON_OVERHEAD_TOKENS)
+        return max(self.MIN_TOKENS, min(budget, self.max_tokens_cap))
+
+    def observe(self, age: int, paragraph: str):
+        """ Record the length of a generated paragraph. """
+        with self._lock:
+            self._stats.setdefault(self._age_group(age), _RunningStats()).add(estimate_tokens(paragraph))
+
+    def report(self, max_tokens: int, completion_tokens: int, stopped_early: bool) -> int:
+        """ Log and count the decode tokens saved by stopping early, return that number.
+            This is an upper bound: without the early stop, the model could have kept
+            decoding up to `max_tokens`.
+        """
+        saved = max(0, max_tokens - completion_tokens) if stopped_early else 0
+        metrics.increment("llm_completion_tokens", completion_tokens)
+        if stopped_early:
+            metrics.increment("llm_early_stops")
+            metrics.increment("llm_decode_tokens_saved", saved)
+        logger.info(
+            f"LLM output: {completion_tokens}/{max_tokens} tokens, "
+            f"stopped early: {stopped_early}, decode tokens saved: {saved}"
+        )
+        return saved
+
+
+# Global instance
+generation_budget = GenerationBudgetController(max_tokens_cap=settings.LLM_MAX_OUTPUT_TOKENS)
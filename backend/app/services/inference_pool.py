@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+from typing import Callable, List, Optional
+from app.core.metrics import metrics
+from app.workers.hf_worker import worker_main
+from app.workers.ipc import read_shared, write_shared
+
+logger = logging.getLogger(__name__)
+
+
+class InferencePoolException(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, ctx, index: int, target: Callable, model: str):
+        self.index = index
+        self.cancel_event = ctx.Event()
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=target,
+            args=(child_conn, self.cancel_event, model),
+            name=f"inference-worker-{index}",
+            daemon=True
+        )
+        self.process.start()
+        # only the worker keeps its end open, so we get an EOF if it dies:
+        child_conn.close()
+
+    def wait_ready(self):
+        """ Block until the worker has loaded its model. """
+        try:
+            message = self.conn.recv()
+        except EOFError:
+            raise InferencePoolException(f"Inference worker {self.index} died while loading the model")
+        if message != ("ready",):
+            raise InferencePoolException(f"Unexpected message from inference worker {self.index}: {message}")
+
+    def close(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+
+
+class InferencePool:
+    """ Pool of worker processes running local model inference out of the API process,
+        so that tokenization and generation loops don't contend for the GIL with the
+        event loop (and the API process never imports torch).
+
+        Workers are forked from a forkserver which preloads `preload` modules: when the
+        model is loaded there, all the workers share its weights copy-on-write.
+        Prompts and results are transferred through shared memory, and crashed
+        workers are replaced automatically.
+    """
+    RESTART_DELAY = 5.0     # seconds to wait before retrying a failed worker restart
+
+    def __init__(self, model: str, size: int, preload: Optional[List[str]] = None, target: Callable = worker_main):
+        self.model = model
+        self.size = size
+        self.preload = preload or []
+        self.target = target
+        self._ctx = multiprocessing.get_context("forkserver")
+        self._workers: List[_Worker] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._job_id = 0
+        self._restarts = set()
+
+    def start(self):
+        """ Start the workers and wait until they've all loaded the model. """
+        if self.preload:
+            # only effective before the forkserver starts, ie: for the first pool
+            self._ctx.set_forkserver_preload(self.preload)
+        self._idle = asyncio.Queue()
+        self._workers = [_Worker(self._ctx, index, self.target, self.model) for index in range(self.size)]
+        for worker in self._workers:
+            worker.wait_ready()
+            self._idle.put_nowait(worker)
+        logger.info(f"Started {self.size} inference workers for {self.model}")
+
+    def stop(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(("stop",))
+            except OSError:
+                pass
+            worker.close()
+        self._workers = []
+
+    def _schedule_restart(self, worker: _Worker):
+        metrics.increment("inference_worker_restarts")
+        logger.error(f"Inference worker {worker.index} died (exit code {worker.process.exitcode}), restarting it")
+        task = asyncio.create_task(self._restart(worker))
+        # keep a reference to the task until it's done:
+        self._restarts.add(task)
+        task.add_done_callback(self._restarts.discard)
+
+    async def _restart(self, worker: _Worker):
+        """ Replace a crashed worker, retrying until the new one is ready. """
+        worker.close()
+        while True:
+            replacement = _Worker(self._ctx, worker.index, self.target, self.model)
+            try:
+                await asyncio.to_thread(replacement.wait_ready)
+                break
+            except InferencePoolException as exc:
+                logger.error(f"Failed to restart inference worker {worker.index}: {str(exc)}")
+                replacement.close()
+                await asyncio.sleep(self.RESTART_DELAY)
+        self._workers[worker.index] = replacement
+        self._idle.put_nowait(replacement)
+
+    async def _acquire(self) -> _Worker:
+        while True:
+            worker = await self._idle.get()
+            if worker.process.is_alive():
+                return worker
+            self._schedule_restart(worker)
+
+    def _release(self, worker: _Worker, reply: asyncio.Future):
+        """ Return the worker to the pool once it replied to its job (or restart it if it died). """
+        if reply.cancelled() or reply.exception() is not None:
+            self._schedule_restart(worker)
+            return
+        message = reply.result()
+        if message[0] == "result":
+            # free the shared memory holding a result nobody is waiting for anymore:
+            read_shared(message[2], message[3])
+        worker.cancel_event.clear()
+        self._idle.put_nowait(worker)
+
+    async def generate(self, prompt: str, **params) -> dict:
+        """ Run a generation job on the next available worker. """
+        worker = await self._acquire()
+        self._job_id += 1
+        name, size = write_shared(prompt.encode())
+        try:
+            worker.conn.send(("generate", self._job_id, name, size, params))
+        except OSError:
+            read_shared(name, size)
+            self._schedule_restart(worker)
+            raise InferencePoolException(f"Inference worker {worker.index} is not reachable")
+
+        reply = asyncio.ensure_future(asyncio.to_thread(worker.conn.recv))
+        try:
+            message = await asyncio.shield(reply)
+        except asyncio.CancelledError:
+            # stop the decode loop in the worker, it'll reply shortly and can then take a new job:
+            worker.cancel_event.set()
+            metrics.increment("hf_generation_cancelled")
+            reply.add_done_callback(lambda reply: self._release(worker, reply))
+            raise
+        except EOFError:
+            self._schedule_restart(worker)
+            raise InferencePoolException(f"Inference worker {worker.index} crashed during generation")
+
+        worker.cancel_event.clear()
+        self._idle.put_nowait(worker)
+        if message[0] == "error":
+            raise InferencePoolException(message[2])
+        return json.loads(read_shared(message[2], message[3]))
@@ -0,0 +1,113 @@
+import logging
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, List, Optional
+from app.core.config import settings, ModelTier
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ModelTierPolicy:
+    """ Picks the model to use for a backend based on the observed load.
+
+        Tiers are ordered from the preferred model to the fastest one. We move to
+        the next tier when the p95 latency of the current one exceeds its SLO or
+        when too many calls are in flight, and move back once latency and load
+        are comfortably below the limits (`recovery_ratio`). Switches are at
+        least `min_dwell` seconds apart so the policy doesn't flap.
+    """
+    MIN_SAMPLES = 5     # latencies needed before the p95 is meaningful
+
+    def __init__(self, name: str, tiers: List[ModelTier], max_in_flight: int,
+                 recovery_ratio: float, min_dwell: float, window: int):
+        self.name = name
+        self.tiers = tiers
+        self.max_in_flight = max_in_flight
+        self.recovery_ratio = recovery_ratio
+        self.min_dwell = min_dwell
+        self.current = 0
+        self.in_flight = 0
+        self._latencies: Dict[str, Deque[float]] = {tier.model: deque(maxlen=window) for tier in tiers}
+        self._last_switch = -math.inf
+
+    def p95(self, model: str) -> Optional[float]:
+        latencies = sorted(self._latencies[model])
+        if len(latencies) < self.MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    def select(self) -> ModelTier:
+        """ Return the tier to use for the next call. """
+        self._maybe_switch()
+        return self.tiers[self.current]
+
+    @contextmanager
+    def track(self, tier: ModelTier):
+        """ Track an LLM call made with `tier`: counts it as in flight and records its latency.
+            Failed, timed out or cancelled calls count as at least as slow as the tier's SLO.
+        """
+        self.in_flight += 1
+        start = time.perf_counter()
+        latency = None
+        try:
+            yield
+            latency = time.perf_counter() - start
+        finally:
+            self.in_flight -= 1
+            if latency is None:
+                latency = max(time.perf_counter() - start, tier.latency_slo)
+            self._latencies[tier.model].append(latency)
+        metrics.increment(f"llm_tier_served.{tier.model}")
+
+    def _maybe_switch(self):
+        if len(self.tiers) < 2 or time.monotonic() - self._last_switch < self.min_dwell:
+            return
+        tier = self.tiers[self.current]
+        p95 = self.p95(tier.model)
+
+        overloaded = self.in_flight >= self.max_in_flight or (p95 is not None and p95 > tier.latency_slo)
+        if overloaded and self.current < len(self.tiers) - 1:
+            self._switch(self.current + 1, f"p95={p95}s, in flight={self.in_flight}")
+            metrics.increment("llm_tier_downgrades")
+            return
+
+        if self.current == 0:
+            return
+        # judged against the SLO of the tier we'd move back to:
+        target = self.tiers[self.current - 1]
+        recovered = (
+            self.in_flight < self.max_in_flight * self.recovery_ratio
+            and p95 is not None and p95 < target.latency_slo * self.recovery_ratio
+        )
+        if recovered:
+            self._switch(self.current - 1, f"p95={p95}s, in flight={self.in_flight}")
+            metrics.increment("llm_tier_upgrades")
+
+    def _switch(self, index: int, reason: str):
+        logger.warning(
+            f"Switching {self.name} model from {self.tiers[self.current].model} "
+            f"to {self.tiers[index].model} ({reason})"
+        )
+        self.current = index
+        self._last_switch = time.monotonic()
+        # latencies observed before the switch were measured under a different load:
+        self._latencies[self.tiers[index].model].clear()
+
+
+def _create_policy(name: str, tiers: List[ModelTier], default_model: str) -> ModelTierPolicy:
+    return ModelTierPolicy(
+        name,
+        tiers=tiers or [ModelTier(model=default_model, latency_slo=math.inf)],
+        max_in_flight=settings.LLM_TIER_MAX_IN_FLIGHT,
+        recovery_ratio=settings.LLM_TIER_RECOVERY_RATIO,
+        min_dwell=settings.LLM_TIER_MIN_DWELL,
+        window=settings.LLM_TIER_LATENCY_WINDOW
+    )
+
+
+# Global instances, one per backend:
+openai_tiers = _create_policy("openai", settings.LLM_OPENAI_MODEL_TIERS, settings.LLM_OPENAI_MODEL)
+ollama_tiers = _create_policy("ollama", settings.LLM_OLLAMA_MODEL_TIERS, settings.LLM_OLLAMA_MODEL)
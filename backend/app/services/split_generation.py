@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Awaitable, Callable, List, Optional
+from app.core.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# end of a sentence, possibly followed by closing quotes/parenthesis:
+SENTENCE_END = re.compile(r'[.!?…]["”»’)]*$')
+
+
+class StreamedStringField:
+    """ Reads the value of a string field out of a JSON object while it's being streamed,
+        eg: the paragraph so far out of '{"paragraph": "Once upon a time, the fox'.
+    """
+    def __init__(self, field: str):
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._text = ""
+        self._start: Optional[int] = None   # index of the first character of the value
+        self._end: Optional[int] = None     # index of the closing quote
+        self._scanned = 0
+        self._escaped = False
+
+    @property
+    def complete(self) -> bool:
+        return self._end is not None
+
+    def feed(self, text: str) -> Optional[str]:
+        """ Feed the next chunk of text, return the (decoded) value so far, if any. """
+        self._text += text
+        if self._start is None:
+            match = self._pattern.search(self._text)
+            if match is None:
+                return None
+            self._start = self._scanned = match.end()
+        if not self.complete:
+            for i in range(self._scanned, len(self._text)):
+                char = self._text[i]
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._end = i
+                    break
+            self._scanned = len(self._text)
+        return self.value
+
+    @property
+    def value(self) -> Optional[str]:
+        if self._start is None:
+            return None
+        raw = self._text[self._start:self._end]
+        try:
+            return json.loads(f'"{raw}"')
+        except ValueError:
+            # the value currently ends in the middle of an escape sequence
+            return None
+
+
+class ChoicesSpeculator:
+    """ Generates the choices for the paragraph being streamed by the main model, so that
+        the choices model already works while the main model decodes the last tokens.
+
+        Once the paragraph reached `min_chars`, a speculative call is started at each end of
+        sentence (replacing the previous one): if the paragraph ends right there, its choices
+        are used, otherwise the choices are generated from the final paragraph.
+    """
+    def __init__(self, generate_choices: Callable[[str], Awaitable[List[str]]], min_chars: int):
+        self.generate_choices = generate_choices
+        self.min_chars = min_chars
+        self._task: Optional[asyncio.Task] = None
+        self._prefix: Optional[str] = None
+
+    def feed(self, paragraph: Optional[str]):
+        """ Feed the paragraph streamed so far. """
+        if paragraph is None:
+            return
+        paragraph = paragraph.strip()
+        if len(paragraph) < self.min_chars or paragraph == self._prefix or not SENTENCE_END.search(paragraph):
+            return
+        self.cancel()
+        self._prefix = paragraph
+        self._task = asyncio.create_task(self.generate_choices(paragraph))
+        # errors are raised when (and if) the result is awaited:
+        self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        metrics.increment("split_choices_speculative_calls")
+
+    async def result(self, paragraph: str) -> List[str]:
+        """ Return the choices for the final `paragraph`. """
+        if self._task is not None and self._prefix == paragraph.strip():
+            metrics.increment("split_choices_speculation_hits")
+            task, self._task = self._task, None
+            return await task
+        self.cancel()
+        return await self.generate_choices(paragraph)
+
+    def cancel(self):
+        """ Cancel the pending speculative call, if any. """
+        if self._task is not None:
+            if not self._task.done():
+                self._task.cancel()
+            metrics.increment("split_choices_speculation_wasted")
+            self._task = None
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Optional
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.core.single_flight import SingleFlight
+from app.core.tracing import tracer
+from app.schemas.story import StoryExportRequest
+from app.workers.story_render import render
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = {"pdf": "application/pdf", "epub": "application/epub+zip"}
+
+# bump when the layout changes, so that the cached exports get rendered again:
+RENDER_VERSION = 1
+
+
+class StoryExportException(Exception):
+    pass
+
+
+class StoryExportBusyException(StoryExportException):
+    pass
+
+
+def export_key(story: StoryExportRequest, format: str) -> str:
+    """ Content hash of an export: the same story in the same format always gets the same key. """
+    content = story.__pydantic_serializer__.to_json(story)
+    return hashlib.sha256(f"{RENDER_VERSION}:{format}:".encode() + content).hexdigest()
+
+
+class ExportCache:
+    """ Content-addressed disk cache of rendered exports. Once the files take more than
+        `max_size` bytes, the least recently used ones are deleted.
+
+        A returned path is leased for `lease_duration` seconds, during which the file isn't
+        evicted, so that the response has the time to open it.
+    """
+    def __init__(self, directory: str, max_size: int, lease_duration: float = 60):
+        self.directory = directory
+        self.max_size = max_size
+        self.lease_duration = lease_duration
+        self._entries: OrderedDict = OrderedDict()     # file name -> size, least recently used first
+        self._leases: Dict[str, float] = {}             # file name -> time until which it can't be evicted
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """ Index the files left by previous runs, by last use (which we keep in their mtime). """
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                # partial write of a previous run
+                os.remove(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        with self._lock:
+            self._entries = OrderedDict((name, size) for _, name, size in sorted(files))
+            self._size = sum(self._entries.values())
+            self._evict()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str, format: str) -> Optional[str]:
+        """ Return the path of the cached export, if any. """
+        name = f"{key}.{format}"
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            try:
+                os.utime(self._path(name))
+            except FileNotFoundError:
+                # deleted behind our back
+                self._size -= self._entries.pop(name)
+                self._leases.pop(name, None)
+                return None
+            self._leases[name] = time.monotonic() + self.lease_duration
+        return self._path(name)
+
+    def put(self, key: str, format: str, data: bytes) -> str:
+        """ Store an export and return its path, evicting older exports if needed. """
+        name = f"{key}.{format}"
+        path = self._path(name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._leases[name] = time.monotonic() + self.lease_duration
+            self._evict()
+        return path
+
+    def _evict(self):
+        now = time.monotonic()
+        for name in list(self._entries):
+            # the most recent export is always kept, even if it's larger than the cache:
+            if self._size <= self.max_size or len(self._entries) <= 1:
+                break
+            if self._leases.get(name, 0) > now:
+                # still being sent, the cache goes over its size until the next eviction
+                continue
+            self._size -= self._entries.pop(name)
+            self._leases.pop(name, None)
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+            metrics.increment("story_export_cache_evictions")
+
+
+class StoryExporter:
+    """ Renders finished stories to PDF or EPUB in a bounded pool of worker processes,
+        so that the CPU-bound layout never blocks the event loop.
+
+        Exports are cached on disk by content hash, and concurrent exports of the same
+        story share a single rendering. Once `max_pending` renderings are queued or
+        running, new ones are refused rather than piling up.
+    """
+    def __init__(self, cache_dir: str, cache_max_size: int, workers: int, max_pending: int):
+        self.cache = ExportCache(cache_dir, cache_max_size)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._pending = 0
+        self._flight = SingleFlight("story_export", grace_period=0)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # workers are started lazily, on the first rendering:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+
+    def start(self):
+        self.cache.load()
+        self._executor = self._create_executor()
+
+    def stop(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def export(self, story: StoryExportRequest, format: str) -> str:
+        """ Return the path of the rendered story, rendering it if it isn't cached yet. """
+        if self._executor is None:
+            raise StoryExportException("Story export is not started")
+        key = export_key(story, format)
+        path = self.cache.get(key, format)
+        if path is not None:
+            metrics.increment("story_export_cache_hits")
+            return path
+        return await self._flight.do(key, lambda: self._render(story, format, key))
+
+    async def _render(self, story: StoryExportRequest, format: str, key: str) -> str:
+        if self._pending >= self.max_pending:
+            metrics.increment("story_export_rejected")
+            raise StoryExportBusyException("Too many exports in progress, please try again later.")
+        self._pending += 1
+        metrics.increment("story_export_renders")
+        executor = self._executor
+        try:
+            with tracer.span("story.export.render", **{"export.format": format}):
+                data = await asyncio.get_running_loop().run_in_executor(executor, render, story, format)
+        except BrokenProcessPool:
+            # a worker died (eg: killed for using too much memory), the pool can't be used anymore:
+            with self._executor_lock:
+                # every rendering of the broken pool fails, only the first one restarts it:
+                if self._executor is executor:
+                    logger.error("Story export worker died, restarting the pool")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._create_executor()
+            raise StoryExportException("Story rendering failed")
+        except Exception as exc:
+            logger.error(f"Story rendering failed: {str(exc)}")
+            raise StoryExportException("Story rendering failed")
+        finally:
+            self._pending -= 1
+        return await asyncio.to_thread(self.cache.put, key, format, data)
+
+
+# Global instance
+story_exporter = StoryExporter(
+    settings.STORY_EXPORT_CACHE_DIR,
+    cache_max_size=settings.STORY_EXPORT_CACHE_MAX_SIZE,
+    workers=settings.STORY_EXPORT_WORKERS,
+    max_pending=settings.STORY_EXPORT_MAX_PENDING
+)
@@ -2,42 +2,88 @@ import logging
 import json
 import httpx
 import random
+from dataclasses import dataclass
 from enum import StrEnum
-from fastapi.concurrency import run_in_threadpool
 from openai import AsyncOpenAI, OpenAIError
 from app.schemas import StoryRequest, StoryPrompt
 from app.core.config import settings
-from typing import Dict, List, Optional, Tuple
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from app.core.metrics import metrics
+from app.core.tracing import tracer
+from app.services.generation_budget import estimate_tokens, generation_budget, JsonObjectTracker
+from app.services.model_tiering import openai_tiers, ollama_tiers
+from app.services.inference_pool import InferencePool
+from app.services.assisted_decoding import assisted_decoding
+from app.services.split_generation import ChoicesSpeculator, StreamedStringField
+from app.services.token_ledger import token_ledger
+from typing import Callable, Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
 
 # OpenAI parameters:
 openai_client = None
-# huggingface parameters:
-hf_pipeline = None
+# huggingface parameters (the model runs in worker processes):
+inference_pool = None
+choices_pool = None   # small model generating the choices in split generation mode
 
 LLM_SYSTEM_PROMPT = "You are a children's storyteller."
+# speculative choices generation starts once the paragraph reached this ratio of its expected length:
+SPECULATION_START_RATIO = 0.5
 
 class StoryGeneratorException(Exception):
     pass
 
 
+@dataclass
+class LLMCompletion:
+    text: str
+    completion_tokens: int
+    stopped_early: bool = False   # decoding was stopped once the JSON object was complete
+    prompt_tokens: int = 0
+
+
+@dataclass
+class StoryStep:
+    paragraph: str
+    choices: List[str]
+    stage_plan: Dict[str, int]
+    model: str  # model that generated the step
+
+
 def initialize():
     """ Initialize the LLMs and pipelines based on configuration. """
     global openai_client
-    global hf_pipeline
+    global inference_pool
+    global choices_pool
     
-    if settings.LLM_METHOD == "openai":
+    choices_method = settings.LLM_CHOICES_METHOD if settings.STORY_SPLIT_GENERATION else None
+    if settings.LLM_METHOD == "openai" or choices_method == "openai":
         openai_client = AsyncOpenAI(
             base_url=settings.LLM_OPENAI_API_URL,
             api_key=settings.LLM_OPENAI_API_KEY
         )
-    elif settings.LLM_METHOD == "huggingface":
-        hf_tokenizer = AutoTokenizer.from_pretrained(settings.LLM_HUGGINGFACE_MODEL)
-        hf_model = AutoModelForCausalLM.from_pretrained(settings.LLM_HUGGINGFACE_MODEL, device_map="auto")
-        hf_pipeline = pipeline("text-generation", model=hf_model, tokenizer=hf_tokenizer)
+    if settings.LLM_METHOD == "huggingface":
+        inference_pool = InferencePool(
+            settings.LLM_HUGGINGFACE_MODEL,
+            settings.LLM_HUGGINGFACE_WORKERS,
+            # load the model once in the forkserver, workers then share its weights:
+            preload=["app.workers.hf_preload"] if settings.LLM_HUGGINGFACE_SHARE_WEIGHTS else None
+        )
+        inference_pool.start()
+    if choices_method == "huggingface":
+        choices_pool = InferencePool(settings.LLM_CHOICES_MODEL, 1)
+        choices_pool.start()
+
+
+def shutdown():
+    """ Release the resources acquired by `initialize`. """
+    global inference_pool
+    global choices_pool
+    for pool in (inference_pool, choices_pool):
+        if pool is not None:
+            pool.stop()
+    inference_pool = None
+    choices_pool = None
 
 
 class Stage(StrEnum):
@@ -116,19 +162,31 @@ class StageManager:
         """ Convert the internal enum-based plan to string keys for API response. """
         return {stage.value: count for stage, count in self.plan.items()}
 
-    def get_stage_guidance(self, step: int) -> str:
+    def get_stage(self, step: int) -> Stage:
         """ Return the stage for the given step (1-indexed). """
         cumulative = 0
         for stage in self.stage_order:
             cumulative += self.plan[stage]
             if step <= cumulative:
-                return self.STAGE_HINTS[stage]
+                return stage
         # fallback
-        stage = self.stage_order[-1]
-        return self.STAGE_HINTS[stage]
+        return self.stage_order[-1]
+
+    def get_stage_guidance(self, step: int) -> str:
+        """ Return the stage hint for the given step (1-indexed). """
+        return self.STAGE_HINTS[self.get_stage(step)]
 
 
-def build_story_prompt(prompt: StoryPrompt, history: List[str], choice: Optional[str], stage_guidance: str) -> str:
+def build_story_prompt(
+    prompt: StoryPrompt,
+    history: List[str],
+    choice: Optional[str],
+    stage_guidance: str,
+    with_choices: bool = True
+) -> str:
+    """ Build the prompt for the next step of the story, `with_choices` False to only
+        ask for the paragraph (the choices being generated separately).
+    """
     instructions = []
     # Base instruction
     instructions.append(
@@ -180,7 +238,7 @@ def build_story_prompt(prompt: StoryPrompt, history: List[str], choice: Optional
     instructions.append("Now write the next paragraph of the story, only write one paragraph at a time.")
     instructions.append(f"Current story stage: {stage_guidance}")
     instructions.append(f"The story should have a total of {prompt.length} paragraphs, so make sure to adjust the storyline and progression accordingly.")
-    if len(history) < prompt.length - 1:
+    if with_choices and len(history) < prompt.length - 1:
         instructions.append("Then offer 2 or 3 engaging choices for what could happen next.")
         instructions.append("Choices should be short descriptions and make sense with the story.")
     
@@ -188,8 +246,16 @@ def build_story_prompt(prompt: StoryPrompt, history: List[str], choice: Optional
         instructions.append("The story is getting close to the end, so make sure to start wrapping it up.")
     elif len(history) == prompt.length - 1:
         instructions.append("The story has reached the desired length, so end it with a satisfying conclusion.")
-        instructions.append("Do not generate choices.")
+        if with_choices:
+            instructions.append("Do not generate choices.")
         
+    if not with_choices:
+        instructions.append((
+            "Format the response as a JSON object with a 'paragraph' field containing the generated story paragraph.\n"
+            "Only return the JSON object, do not include any additional text or formatting.\n"
+            "Example: {\"paragraph\": \"next paragraph\"}"
+        ))
+        return "\n".join(instructions)
 
     instructions.append((
         "Format the response as a JSON object with a 'paragraph' field containing the generated story paragraph "
@@ -201,92 +267,319 @@ def build_story_prompt(prompt: StoryPrompt, history: List[str], choice: Optional
     return "\n".join(instructions)
 
 
-async def llm_get_story_json_openai(prompt) -> str:
+def build_choices_prompt(prompt: StoryPrompt, history: List[str], paragraph: str) -> str:
+    """ Build the prompt asking for the choices following `paragraph` (split generation mode). """
+    instructions = [
+        f"Here is a Choose-your-own-adventure style story for a {prompt.age}-year-old child in {prompt.language}:",
+        ""
+    ]
+    # the last paragraphs are enough context for the choices:
+    for i, para in enumerate(history[-2:] + [paragraph], start=max(1, len(history) - 1)):
+        instructions.append(f"Part {i}: {para}")
+    instructions.append("")
+    instructions.append((
+        f"Offer 2 or 3 engaging choices in {prompt.language} for what could happen next, right after the last part.\n"
+        "Choices should be short descriptions and make sense with the story.\n"
+        "Format the response as a JSON list of strings, only return the JSON list, do not include any additional text or formatting.\n"
+        "Example: [\"Choice 1\", \"Choice 2\", \"Choice 3\"]"
+    ))
+    return "\n".join(instructions)
+
+
+async def llm_get_story_json_openai(
+    prompt: str,
+    max_tokens: int,
+    model: str,
+    on_token: Optional[Callable[[str], None]] = None
+) -> LLMCompletion:
+    # the response is streamed so that cancelling the request closes the upstream
+    # HTTP stream and the LLM provider stops generating tokens nobody will read,
+    # it also lets us stop as soon as the JSON object is complete:
     try:
-        response = await openai_client.chat.completions.create(
-            model=settings.LLM_OPENAI_MODEL,
+        stream = await openai_client.chat.completions.create(
+            model=model,
             messages=[
                 {"role": "system", "content": LLM_SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            max_tokens=max_tokens,
+            stream=True,
+            # the last chunk reports the token usage:
+            stream_options={"include_usage": True}
         )
+        span = tracer.current_span()
+        content = []
+        tracker = JsonObjectTracker()
+        completion_tokens = 0
+        stopped_early = False
+        usage = None
+        async with stream:
+            async for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if stopped_early:
+                        # the model keeps going after the JSON object, stop reading
+                        break
+                    if completion_tokens == 0:
+                        span.set_attribute("llm.time_to_first_token_ms", span.elapsed_ms())
+                    # each streamed chunk holds a single token:
+                    completion_tokens += 1
+                    content.append(chunk.choices[0].delta.content)
+                    if on_token:
+                        on_token(chunk.choices[0].delta.content)
+                    if tracker.feed(chunk.choices[0].delta.content):
+                        # read on until the next token: if the model stops right after the
+                        # JSON object, the final chunks (with the usage) come without delay
+                        stopped_early = True
+        if usage:
+            return LLMCompletion(
+                tracker.extract("".join(content)), usage.completion_tokens, stopped_early, usage.prompt_tokens
+            )
+        # the prompt isn't tokenized on our side, estimate it:
+        prompt_tokens = estimate_tokens(LLM_SYSTEM_PROMPT + prompt)
+        return LLMCompletion(tracker.extract("".join(content)), completion_tokens, stopped_early, prompt_tokens)
     except OpenAIError as exc:
         raise StoryGeneratorException(f"Error calling LLM API: {str(exc)}")
-    
-    try:
-        return response.choices[0].message.content
-    except (KeyError, IndexError, AttributeError) as exc:
+    except (KeyError, IndexError, AttributeError, TypeError) as exc:
         raise StoryGeneratorException(f"Invalid LLM response: {str(exc)}")
     
 
-async def llm_get_story_json_ollama(prompt: str) -> str:
+async def llm_get_story_json_ollama(
+    prompt: str,
+    max_tokens: int,
+    model: str,
+    on_token: Optional[Callable[[str], None]] = None
+) -> LLMCompletion:
     try:
         async with httpx.AsyncClient() as client:
-            response = await client.post(
+            # stream the response so that cancelling the request (or stopping once the
+            # JSON object is complete) closes the connection, which makes Ollama abort the generation:
+            async with client.stream(
+                "POST",
                 settings.LLM_OLLAMA_API_URL,
                 json={
-                    "model": settings.LLM_OLLAMA_MODEL,
+                    "model": model,
                     "system": LLM_SYSTEM_PROMPT,
                     "prompt": prompt,
-                    "stream": False
+                    "stream": True,
+                    "options": {"num_predict": max_tokens}
                 },
                 headers={"Content-Type": "application/json"},
                 timeout=60
-            )
-            response.raise_for_status()
-            return response.json()["response"]
+            ) as response:
+                response.raise_for_status()
+                span = tracer.current_span()
+                content = []
+                tracker = JsonObjectTracker()
+                completion_tokens = 0
+                stopped_early = False
+                # estimated, unless the stream ends with the final statistics:
+                prompt_tokens = estimate_tokens(LLM_SYSTEM_PROMPT + prompt)
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("done"):
+                        prompt_tokens = data.get("prompt_eval_count", prompt_tokens)
+                        completion_tokens = data.get("eval_count", completion_tokens)
+                        break
+                    if stopped_early:
+                        # the model keeps going after the JSON object, stop reading
+                        break
+                    if completion_tokens == 0:
+                        span.set_attribute("llm.time_to_first_token_ms", span.elapsed_ms())
+                    # each streamed line holds a single token:
+                    completion_tokens += 1
+                    content.append(data["response"])
+                    if on_token:
+                        on_token(data["response"])
+                    if tracker.feed(data["response"]):
+                        # read on until the next token, to get the final statistics if the model stops here
+                        stopped_early = True
+                return LLMCompletion(tracker.extract("".join(content)), completion_tokens, stopped_early, prompt_tokens)
     except httpx.HTTPStatusError as exc:
         raise StoryGeneratorException(f"HTTP error from Ollama LLM:: {str(exc)}")
     except httpx.RequestError as exc:
         raise StoryGeneratorException(f"Network error calling Ollama LLM: {str(exc)}")
-    except (KeyError, TypeError) as exc:
+    except (KeyError, TypeError, ValueError) as exc:
         raise StoryGeneratorException(f"Invalid LLM response: {str(exc)}")
     
     
-async def llm_get_story_json_huggingface(prompt) -> str:
+async def llm_get_story_json_huggingface(prompt: str, max_tokens: int, pool: Optional[InferencePool] = None) -> LLMCompletion:
+    # the output isn't streamed back from the worker processes, so there is no `on_token` here
     try:
-        prompt = f"{LLM_SYSTEM_PROMPT}\n\n{prompt}"
-        result = await run_in_threadpool(
-            hf_pipeline,
-            prompt,
-            max_new_tokens=300,
-            temperature=0.8,
-            do_sample=True
+        main_model = pool is None
+        # assisted decoding with the draft model, for the main model only:
+        draft_model = assisted_decoding.pick_draft_model() if main_model else None
+        # generation runs in a worker process, cancelling this call stops its decode loop:
+        result = await (inference_pool if main_model else pool).generate(
+            f"{LLM_SYSTEM_PROMPT}\n\n{prompt}",
+            max_new_tokens=max_tokens,
+            draft_model=draft_model
         )
-        return result[0]["generated_text"]
+        span = tracer.current_span()
+        if result["time_to_first_token_ms"] is not None:
+            span.set_attribute("llm.time_to_first_token_ms", result["time_to_first_token_ms"])
+        span.set_attribute("llm.assisted", result["assisted"])
+        if main_model:
+            assisted_decoding.observe(result)
+        return LLMCompletion(result["text"], result["completion_tokens"], result["stopped_early"], result["prompt_tokens"])
     except Exception as exc:
         raise StoryGeneratorException(f"Error calling HuggingFace LLM: {str(exc)}")
         
 
-async def llm_generate_story(request: StoryRequest):
+async def llm_get_story_json(
+    prompt: str,
+    max_tokens: int,
+    on_token: Optional[Callable[[str], None]] = None
+) -> Tuple[LLMCompletion, str]:
+    """ Call the main LLM, return its completion and the model used. """
+    if settings.LLM_METHOD == "openai":
+        # switch to a faster model when the upstream is under pressure:
+        tier = openai_tiers.select()
+        with openai_tiers.track(tier):
+            return await llm_get_story_json_openai(prompt, max_tokens, tier.model, on_token), tier.model
+    elif settings.LLM_METHOD == "ollama":
+        tier = ollama_tiers.select()
+        with ollama_tiers.track(tier):
+            return await llm_get_story_json_ollama(prompt, max_tokens, tier.model, on_token), tier.model
+    elif settings.LLM_METHOD == "huggingface":
+        return await llm_get_story_json_huggingface(prompt, max_tokens), settings.LLM_HUGGINGFACE_MODEL
+    else:
+        raise StoryGeneratorException(f"Unsupported LLM method: {settings.LLM_METHOD}")
+
+
+async def llm_generate_choices(prompt: StoryPrompt, history: List[str], paragraph: str) -> List[str]:
+    """ Call the small choices LLM to generate the choices following `paragraph`. """
+    choices_prompt = build_choices_prompt(prompt, history, paragraph)
+    method = settings.LLM_CHOICES_METHOD
+    model = settings.LLM_CHOICES_MODEL
+    max_tokens = settings.LLM_CHOICES_MAX_TOKENS
+    with tracer.span("llm.choices", **{"llm.method": method, "llm.model": model}) as span:
+        if method == "openai":
+            completion = await llm_get_story_json_openai(choices_prompt, max_tokens, model)
+        elif method == "ollama":
+            completion = await llm_get_story_json_ollama(choices_prompt, max_tokens, model)
+        elif method == "huggingface":
+            completion = await llm_get_story_json_huggingface(choices_prompt, max_tokens, choices_pool)
+        else:
+            raise StoryGeneratorException(f"Unsupported choices LLM method: {method}")
+        span.set_attribute("llm.prompt_tokens", completion.prompt_tokens)
+        span.set_attribute("llm.completion_tokens", completion.completion_tokens)
+    metrics.increment("llm_choices_completion_tokens", completion.completion_tokens)
+    token_ledger.count(completion.prompt_tokens, completion.completion_tokens)
+
+    try:
+        choices = json.loads(completion.text.strip().strip("`'\""))
+    except json.JSONDecodeError as exc:
+        raise StoryGeneratorException(f"Invalid JSON from choices LLM: {str(exc)}")
+    # some models wrap the list in an object:
+    if isinstance(choices, dict):
+        choices = choices.get("choices")
+    if not isinstance(choices, list) or not choices or not all(isinstance(choice, str) for choice in choices):
+        raise StoryGeneratorException(f"Invalid choices from choices LLM: {completion.text}")
+    return choices[:3]
+
+
+def parse_story_json(text: str, with_choices: bool) -> dict:
+    """ Parse the story step returned by the main LLM: its paragraph and, when `with_choices`,
+        the (non-empty) choices following it. Raise a StoryGeneratorException if it isn't valid.
+    """
+    # strip whitespace, backticks and quotes:
+    json_content = text.strip().strip("`'\"")
+    logger.info(f"LLM response content: {json_content}")
+    try:
+        story = json.loads(json_content)
+    except json.JSONDecodeError as exc:
+        raise StoryGeneratorException(f"Invalid JSON from LLM: {str(exc)}")
+    if not isinstance(story, dict) or not isinstance(story.get("paragraph"), str) or not story["paragraph"]:
+        raise StoryGeneratorException(f"Invalid story from LLM: {json_content}")
+    choices = story.setdefault("choices", [])
+    if not isinstance(choices, list) or not all(isinstance(choice, str) for choice in choices):
+        raise StoryGeneratorException(f"Invalid choices from LLM: {json_content}")
+    if with_choices and not choices:
+        raise StoryGeneratorException(f"Missing choices from LLM: {json_content}")
+    return story
+
+
+async def llm_generate_story(request: StoryRequest) -> StoryStep:
     """ Call an LLM to generate a Choose-your-own-adventure style story. """
         
     logger.info(f"Generating story based on story request: {request}")
 
     # Create stage manager to get/create the stage plan:
-    stage_manager = StageManager(request.prompt.length, request.stage_plan)
-    stage_guidance = stage_manager.get_stage_guidance(len(request.history))
-    stage_plan = stage_manager.get_plan_as_strings()
+    with tracer.span("story.stage_manager"):
+        stage_manager = StageManager(request.prompt.length, request.stage_plan)
+        stage = stage_manager.get_stage(len(request.history))
+        stage_guidance = stage_manager.get_stage_guidance(len(request.history))
+        stage_plan = stage_manager.get_plan_as_strings()
     logger.info(f"Story stage plan: {stage_plan}")
 
-    prompt = build_story_prompt(request.prompt, request.history, request.choice, stage_guidance)
+    split = settings.STORY_SPLIT_GENERATION
+    # the last paragraph of the story has no choices:
+    with_choices = len(request.history) < request.prompt.length - 1
+
+    with tracer.span("story.build_prompt") as span:
+        prompt = build_story_prompt(request.prompt, request.history, request.choice, stage_guidance, with_choices=not split)
+        span.set_attribute("story.prompt_chars", len(prompt))
     logger.info(f"Generated prompt for LLM: {prompt}")
     
-    if settings.LLM_METHOD == "openai":
-        json_content = await llm_get_story_json_openai(prompt)
-    elif settings.LLM_METHOD == "ollama":
-        json_content = await llm_get_story_json_ollama(prompt)
-    elif settings.LLM_METHOD == "huggingface":
-        json_content = await llm_get_story_json_huggingface(prompt)
-    else:
-        raise StoryGeneratorException(f"Unsupported LLM method: {settings.LLM_METHOD}") 
+    max_tokens = generation_budget.max_tokens_for(request.prompt, request.history, stage, with_choices=not split)
     
+    on_token = None
+    speculator = None
+    if split and with_choices:
+        # start generating the choices while the end of the paragraph is being streamed:
+        paragraph_field = StreamedStringField("paragraph")
+        expected_tokens = generation_budget.expected_paragraph_tokens(request.prompt, request.history, stage)
+        speculator = ChoicesSpeculator(
+            lambda paragraph: llm_generate_choices(request.prompt, request.history, paragraph),
+            min_chars=int(expected_tokens * 4 * SPECULATION_START_RATIO)
+        )
+        on_token = lambda text: speculator.feed(paragraph_field.feed(text))
+
+    async def generate(max_tokens: int, on_token: Optional[Callable[[str], None]]) -> Tuple[LLMCompletion, str]:
+        with tracer.span("llm.generate", **{"llm.method": settings.LLM_METHOD, "llm.max_tokens": max_tokens}) as span:
+            completion, model = await llm_get_story_json(prompt, max_tokens, on_token)
+            span.set_attribute("llm.model", model)
+            span.set_attribute("llm.prompt_tokens", completion.prompt_tokens)
+            span.set_attribute("llm.completion_tokens", completion.completion_tokens)
+            span.set_attribute("llm.stopped_early", completion.stopped_early)
+        
+        generation_budget.report(max_tokens, completion.completion_tokens, completion.stopped_early)
+        token_ledger.count(completion.prompt_tokens, completion.completion_tokens)
+        return completion, model
+
+    def parse(completion: LLMCompletion) -> dict:
+        with tracer.span("story.parse_json"):
+            return parse_story_json(completion.text, with_choices=with_choices and not split)
+
     try:
-        # strip whitespace, backticks and quotes:
-        json_content = json_content.strip().strip("`'\"")
-        logger.info(f"LLM response content: {json_content}")
-        story = json.loads(json_content)
-    except json.JSONDecodeError as exc:
-        raise StoryGeneratorException(f"Invalid JSON from LLM: {str(exc)}")
+        completion, model = await generate(max_tokens, on_token)
+        try:
+            story = parse(completion)
+        except StoryGeneratorException:
+            truncated = not completion.stopped_early and completion.completion_tokens >= max_tokens
+            if not truncated or max_tokens >= generation_budget.max_tokens_cap:
+                raise
+            # the JSON object never completed before the token budget ran out: retry
+            # once with the max budget (without speculating on the choices)
+            logger.warning(f"LLM response cut off at {max_tokens} tokens, retrying with {generation_budget.max_tokens_cap}")
+            metrics.increment("llm_truncation_retries")
+            completion, model = await generate(generation_budget.max_tokens_cap, None)
+            story = parse(completion)
+        
+        if not split:
+            choices = story["choices"]
+        elif speculator:
+            choices = await speculator.result(story["paragraph"])
+        else:
+            choices = []
+    finally:
+        if speculator:
+            speculator.cancel()
+    
+    generation_budget.observe(request.prompt.age, story["paragraph"])
     
-    return story["paragraph"], story["choices"], stage_plan
+    return StoryStep(story["paragraph"], choices, stage_plan, model)
@@ -0,0 +1,290 @@
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas.story import StoryPrompt
+from app.schemas.tokens import TokenUsageRecord
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_requests (
+    created_at REAL NOT NULL,
+    client TEXT NOT NULL,
+    story TEXT,
+    model TEXT,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_token_requests_created_at ON token_requests(created_at);
+CREATE TABLE IF NOT EXISTS token_usage (
+    day TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    key TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    requests INTEGER NOT NULL,
+    PRIMARY KEY (day, scope, key)
+) WITHOUT ROWID;
+"""
+
+UPSERT_USAGE = """
+INSERT INTO token_usage (day, scope, key, prompt_tokens, completion_tokens, requests) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (day, scope, key) DO UPDATE SET
+    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+    completion_tokens = completion_tokens + excluded.completion_tokens,
+    requests = requests + excluded.requests
+"""
+
+
+# length of the longest stories, which `story_budget` is given for (see StoryPrompt.length):
+MAX_STORY_LENGTH = 60
+
+
+class TokenBudgetExceededException(Exception):
+    pass
+
+
+@dataclass
+class TokenUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def story_key(prompt: StoryPrompt, first_paragraph: str) -> str:
+    """ Identify a story by its prompt and first paragraph, which every request of the story carries. """
+    content = prompt.__pydantic_serializer__.to_json(prompt) + first_paragraph.encode()
+    # 64 bits are plenty to tell stories apart, and keep the store compact:
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+# usage of the request being handled:
+_current_usage: ContextVar[Optional[TokenUsage]] = ContextVar("token_usage", default=None)
+
+
+class TokenLedger:
+    """ Accounts for the LLM tokens used per request, per story and per client, and
+        enforces daily token budgets (per UTC day) on stories and clients.
+
+        Each request is recorded in memory and written to a local SQLite database in
+        batches by a background task, along with daily totals per story and per client.
+        Today's totals are also kept in memory, so budget checks never wait on the disk.
+    """
+    def __init__(
+        self,
+        db_path: str,
+        story_budget: int,
+        client_budget: int,
+        batch_size: int,
+        flush_interval: float,
+        retention_days: int
+    ):
+        self.db_path = db_path
+        self.story_budget = story_budget
+        self.client_budget = client_budget
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._day = _today()
+        self._totals: Dict[Tuple[str, str], int] = {}   # (scope, key) -> tokens used today
+        self._pending_requests: List[tuple] = []
+        self._pending_usage: Dict[Tuple[str, str, str], List[int]] = {}   # (day, scope, key) -> [prompt, completion, requests]
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._connection: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    async def start(self):
+        """ Create the database if needed, load today's totals and start the background writer. """
+        if os.path.dirname(self.db_path):
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._connection = self._connect()
+        self._connection.executescript(SCHEMA)
+        self._day = _today()
+        rows = self._connection.execute(
+            "SELECT scope, key, prompt_tokens + completion_tokens FROM token_usage WHERE day = ?",
+            (self._day,)
+        ).fetchall()
+        self._totals = {(scope, key): tokens for scope, key, tokens in rows}
+        self._stopping = False
+        self._writer = asyncio.create_task(self._run_writer())
+
+    async def stop(self):
+        """ Write the pending records and stop the background writer. """
+        if self._writer is not None:
+            self._stopping = True
+            self._wake.set()
+            await self._writer
+            self._writer = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    @contextmanager
+    def track(self) -> Iterator[TokenUsage]:
+        """ Collect the tokens of the LLM calls made in this context (and the tasks it starts). """
+        usage = TokenUsage()
+        token = _current_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _current_usage.reset(token)
+
+    def count(self, prompt_tokens: int, completion_tokens: int):
+        """ Add the tokens of an LLM call to the usage being tracked, if any. """
+        metrics.increment("llm_prompt_tokens", prompt_tokens)
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+
+    def _roll_day(self) -> str:
+        today = _today()
+        if today != self._day:
+            self._day = today
+            self._totals = {}
+        return today
+
+    def used(self, scope: str, key: str) -> int:
+        """ Tokens used today by the story or client `key`. """
+        self._roll_day()
+        return self._totals.get((scope, key), 0)
+
+    def story_budget_for(self, length: int) -> int:
+        """ Token budget of a story of `length` paragraphs. Each request sends the story so far, so a
+            story sends ~length²/2 paragraphs, plus the instructions and the completion of each request
+            (~1.5 paragraph): the budget follows length × (length + 3).
+        """
+        return self.story_budget * length * (length + 3) // (MAX_STORY_LENGTH * (MAX_STORY_LENGTH + 3))
+
+    def check(self, client: str, story: Optional[str], length: int = MAX_STORY_LENGTH):
+        """ Raise if the client or the story (of `length` paragraphs) already used up its token budget for today. """
+        if self.client_budget and self.used("client", client) >= self.client_budget:
+            metrics.increment("token_budget_rejections")
+            raise TokenBudgetExceededException("Daily token budget exceeded, please come back tomorrow.")
+        if story and self.story_budget and self.used("story", story) >= self.story_budget_for(length):
+            metrics.increment("token_budget_rejections")
+            raise TokenBudgetExceededException("This story used up its token budget for today, please come back tomorrow.")
+
+    def record(self, client: str, story: Optional[str], model: Optional[str], usage: TokenUsage):
+        """ Record the tokens used by a request, they're written to the database in the next batch. """
+        if usage.total_tokens == 0:
+            return
+        day = self._roll_day()
+        for scope, key in (("client", client), ("story", story)):
+            if key is None:
+                continue
+            self._totals[(scope, key)] = self._totals.get((scope, key), 0) + usage.total_tokens
+            pending = self._pending_usage.setdefault((day, scope, key), [0, 0, 0])
+            pending[0] += usage.prompt_tokens
+            pending[1] += usage.completion_tokens
+            pending[2] += 1
+        self._pending_requests.append((time.time(), client, story, model, usage.prompt_tokens, usage.completion_tokens))
+        if len(self._pending_requests) >= self.batch_size:
+            self._wake.set()
+
+    async def _run_writer(self):
+        running = True
+        while running:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except TimeoutError:
+                pass
+            self._wake.clear()
+            running = not self._stopping
+            await self.flush()
+
+    async def flush(self):
+        """ Write the pending records to the database. """
+        async with self._flush_lock:
+            if not self._pending_requests or self._connection is None:
+                return
+            requests, usage = self._pending_requests, self._pending_usage
+            self._pending_requests, self._pending_usage = [], {}
+            try:
+                await asyncio.to_thread(self._write_batch, requests, usage)
+            except sqlite3.Error as exc:
+                logger.error(f"Failed to store {len(requests)} token usage records, retrying later: {str(exc)}")
+                # put them back for the next batch:
+                self._pending_requests = requests + self._pending_requests
+                for key, (prompt_tokens, completion_tokens, count) in usage.items():
+                    pending = self._pending_usage.setdefault(key, [0, 0, 0])
+                    pending[0] += prompt_tokens
+                    pending[1] += completion_tokens
+                    pending[2] += count
+
+    def _write_batch(self, requests: List[tuple], usage: Dict[Tuple[str, str, str], List[int]]):
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO token_requests (created_at, client, story, model, prompt_tokens, completion_tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                requests
+            )
+            self._connection.executemany(UPSERT_USAGE, [(*key, *values) for key, values in usage.items()])
+            # the daily totals are kept, only the detail of old requests is deleted:
+            self._connection.execute(
+                "DELETE FROM token_requests WHERE created_at < ?",
+                (time.time() - self.retention_days * 86400,)
+            )
+
+    def query(self, scope: str, day: date, key: Optional[str] = None, limit: int = 50) -> List[TokenUsageRecord]:
+        """ Return the usage of the given day per story or per client, largest consumers first. """
+        sql = "SELECT key, prompt_tokens, completion_tokens, requests FROM token_usage WHERE day = ? AND scope = ?"
+        params = [day.isoformat(), scope]
+        if key is not None:
+            sql += " AND key = ?"
+            params.append(key)
+        sql += " ORDER BY prompt_tokens + completion_tokens DESC LIMIT ?"
+        params.append(limit)
+
+        connection = self._connect()
+        try:
+            rows = connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+        return [
+            TokenUsageRecord(
+                key=row[0],
+                prompt_tokens=row[1],
+                completion_tokens=row[2],
+                total_tokens=row[1] + row[2],
+                requests=row[3]
+            )
+            for row in rows
+        ]
+
+
+# Global instance
+token_ledger = TokenLedger(
+    db_path=settings.TOKEN_LEDGER_DB_PATH,
+    story_budget=settings.TOKEN_BUDGET_PER_STORY,
+    client_budget=settings.TOKEN_BUDGET_PER_CLIENT,
+    batch_size=settings.TOKEN_LEDGER_WRITE_BATCH_SIZE,
+    flush_interval=settings.TOKEN_LEDGER_WRITE_INTERVAL,
+    retention_days=settings.TOKEN_LEDGER_RETENTION_DAYS
+)
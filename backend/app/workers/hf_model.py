@@ -0,0 +1,113 @@
+# HuggingFace model and generation, only ever imported by the inference worker
+# processes (see hf_worker.py) so that the API process never imports torch.
+import threading
+import time
+from typing import Optional
+from transformers import AutoTokenizer, AutoModelForCausalLM, StoppingCriteria, StoppingCriteriaList, pipeline
+from app.services.generation_budget import JsonObjectTracker
+
+hf_pipelines = {}
+draft_models = {}
+# number of forward passes of each draft model, ie: of tokens it proposed:
+draft_forwards = {}
+
+
+def load(model_name: str):
+    """ Load a model (once per process, workers forked from a preloaded process share it). """
+    if model_name not in hf_pipelines:
+        hf_tokenizer = AutoTokenizer.from_pretrained(model_name)
+        hf_model = AutoModelForCausalLM.from_pretrained(model_name, device_map="auto")
+        hf_pipelines[model_name] = pipeline("text-generation", model=hf_model, tokenizer=hf_tokenizer)
+    return hf_pipelines[model_name]
+
+
+def load_draft(model_name: str):
+    """ Load a draft model for assisted decoding, it must share the tokenizer of the main model. """
+    if model_name not in draft_models:
+        draft_model = AutoModelForCausalLM.from_pretrained(model_name, device_map="auto")
+        draft_forwards[model_name] = 0
+
+        def count_forward(module, args, output):
+            draft_forwards[model_name] += 1
+
+        draft_model.register_forward_hook(count_forward)
+        draft_models[model_name] = draft_model
+    return draft_models[model_name]
+
+
+class CancellationStoppingCriteria(StoppingCriteria):
+    """ Stops HuggingFace generation mid-decode once `cancel_event` is set. """
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        return self.cancel_event.is_set()
+
+
+class JsonCompleteStoppingCriteria(StoppingCriteria):
+    """ Stops HuggingFace generation as soon as the top-level JSON object has been emitted. """
+    def __init__(self, tokenizer, prompt_length: int):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.tracker = JsonObjectTracker()
+        self.generated_tokens = 0
+        self.steps = 0      # forward passes of the main model (several tokens per pass with assisted decoding)
+        self.first_token_time: Optional[float] = None
+        self._text = ""
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        new_tokens = input_ids[0, self.prompt_length:]
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.generated_tokens = len(new_tokens)
+        self.steps += 1
+        # decode everything generated so far, as single tokens don't always decode to the right text:
+        text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+        self.tracker.feed(text[len(self._text):])
+        self._text = text
+        return self.tracker.complete
+
+
+def generate(model_name: str, prompt: str, max_new_tokens: int, cancel_event, draft_model: Optional[str] = None) -> dict:
+    """ Generate the story JSON for `prompt`, stopping early once the JSON object
+        is complete or as soon as `cancel_event` is set.
+        With a `draft_model`, assisted decoding is used: the draft model proposes
+        tokens which the main model verifies in a single forward pass.
+    """
+    hf_pipeline = load(model_name)
+    assist = {}
+    if draft_model:
+        assist["assistant_model"] = load_draft(draft_model)
+        draft_forwards_before = draft_forwards[draft_model]
+    start = time.perf_counter()
+    json_criteria = JsonCompleteStoppingCriteria(
+        hf_pipeline.tokenizer,
+        prompt_length=len(hf_pipeline.tokenizer(prompt)["input_ids"])
+    )
+    result = hf_pipeline(
+        prompt,
+        max_new_tokens=max_new_tokens,
+        temperature=0.8,
+        do_sample=True,
+        return_full_text=False,
+        stopping_criteria=StoppingCriteriaList([
+            CancellationStoppingCriteria(cancel_event),
+            json_criteria
+        ]),
+        **assist
+    )
+    decode_time = time.perf_counter() - start
+    first_token_time = json_criteria.first_token_time
+    draft_tokens = draft_forwards[draft_model] - draft_forwards_before if draft_model else 0
+    return {
+        "text": json_criteria.tracker.extract(result[0]["generated_text"]),
+        "prompt_tokens": json_criteria.prompt_length,
+        "completion_tokens": json_criteria.generated_tokens,
+        "stopped_early": json_criteria.tracker.complete,
+        "cancelled": cancel_event.is_set(),
+        "time_to_first_token_ms": (first_token_time - start) * 1000 if first_token_time else None,
+        "decode_ms": decode_time * 1000,
+        "assisted": bool(draft_model),
+        "main_model_steps": json_criteria.steps,
+        "draft_tokens": draft_tokens,
+    }
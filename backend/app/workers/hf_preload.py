@@ -0,0 +1,16 @@
+# Preloaded by the inference pool's forkserver process: the model is loaded once
+# there and every worker forked from it shares the weights copy-on-write.
+# CUDA can't be used in forked processes, so with a GPU every worker loads its own model.
+import logging
+import torch
+from app.core.config import settings
+from app.workers import hf_model
+
+logger = logging.getLogger(__name__)
+
+if torch.cuda.is_available():
+    logger.warning("LLM_HUGGINGFACE_SHARE_WEIGHTS only applies to CPU inference, workers will load their own model")
+else:
+    hf_model.load(settings.LLM_HUGGINGFACE_MODEL)
+    if settings.LLM_HUGGINGFACE_DRAFT_MODEL:
+        hf_model.load_draft(settings.LLM_HUGGINGFACE_DRAFT_MODEL)
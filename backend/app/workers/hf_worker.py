@@ -0,0 +1,40 @@
+import json
+import logging
+import signal
+from app.workers.ipc import read_shared, write_shared
+
+logger = logging.getLogger(__name__)
+
+
+def worker_main(conn, cancel_event, model_name: str):
+    """ Entry point of an inference worker process.
+
+        Protocol over `conn` (prompts and results go through shared memory):
+        - worker -> API: ("ready",) once the model is loaded
+        - API -> worker: ("generate", job_id, shm_name, size, params) or ("stop",)
+        - worker -> API: ("result", job_id, shm_name, size) or ("error", job_id, message)
+    """
+    # the API process handles Ctrl-C and stops the workers itself:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # heavy imports (torch, transformers) only happen in the worker process:
+    from app.workers import hf_model
+    hf_model.load(model_name)
+    conn.send(("ready",))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return  # the API process went away
+        if message[0] == "stop":
+            return
+
+        _, job_id, name, size, params = message
+        try:
+            prompt = read_shared(name, size).decode()
+            result = hf_model.generate(model_name, prompt, cancel_event=cancel_event, **params)
+            result_name, result_size = write_shared(json.dumps(result).encode())
+            conn.send(("result", job_id, result_name, result_size))
+        except Exception as exc:
+            logger.exception(f"Inference job {job_id} failed")
+            conn.send(("error", job_id, f"{type(exc).__name__}: {str(exc)}"))
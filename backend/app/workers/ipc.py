@@ -0,0 +1,24 @@
+from multiprocessing.shared_memory import SharedMemory
+from typing import Tuple
+
+
+def write_shared(data: bytes) -> Tuple[str, int]:
+    """ Copy `data` into a new shared memory block, return its name and the data size.
+        The block is owned by the reader from then on, see `read_shared`.
+    """
+    block = SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        block.buf[:len(data)] = data
+        return block.name, len(data)
+    finally:
+        block.close()
+
+
+def read_shared(name: str, size: int) -> bytes:
+    """ Read the data of the shared memory block `name` and release the block. """
+    block = SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
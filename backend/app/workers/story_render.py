@@ -0,0 +1,156 @@
+import html
+import io
+import uuid
+import zipfile
+from datetime import datetime, timezone
+from app.schemas.story import Character, StoryExportRequest
+
+LABELS = {
+    "english": {"characters": "Characters", "title": "My story", "language": "en"},
+    "french": {"characters": "Personnages", "title": "Mon histoire", "language": "fr"},
+}
+
+# the PDF core fonts only cover latin-1, LLMs like typographic characters outside of it:
+LATIN1_FALLBACKS = str.maketrans({
+    "‘": "'", "’": "'", "‚": ",", "“": '"', "”": '"', "„": '"',
+    "–": "-", "—": "-", "…": "...", "œ": "oe", "Œ": "OE", "\u202f": " ",
+})
+
+
+def story_title(story: StoryExportRequest) -> str:
+    if story.title and story.title.strip():
+        return story.title.strip()
+    if story.prompt.characters:
+        return " & ".join(character.name for character in story.prompt.characters)
+    return LABELS[story.prompt.language]["title"]
+
+
+def _describe(character: Character) -> str:
+    details = [detail for detail in (character.type, character.personality) if detail]
+    return f"{character.name} ({', '.join(details)})" if details else character.name
+
+
+def _characters_line(story: StoryExportRequest) -> str:
+    if not story.prompt.characters:
+        return ""
+    label = LABELS[story.prompt.language]["characters"]
+    return f"{label}: " + ", ".join(_describe(character) for character in story.prompt.characters)
+
+
+def _latin1(text: str) -> str:
+    return text.translate(LATIN1_FALLBACKS).encode("latin-1", "replace").decode("latin-1")
+
+
+def render_pdf(story: StoryExportRequest) -> bytes:
+    """ Lay the story out as an A5 booklet: title, characters, then the paragraphs. """
+    # only imported in the export worker processes:
+    from fpdf import FPDF
+
+    title = story_title(story)
+    pdf = FPDF(format=(148, 210))  # A5, in mm
+    pdf.set_title(title)
+    pdf.set_lang(LABELS[story.prompt.language]["language"])
+    pdf.set_creator("Tale Hopper")
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+
+    pdf.set_font("Helvetica", "B", 20)
+    pdf.multi_cell(0, 10, _latin1(title), align="C", new_x="LMARGIN", new_y="NEXT")
+    characters = _characters_line(story)
+    if characters:
+        pdf.ln(2)
+        pdf.set_font("Helvetica", "I", 10)
+        pdf.multi_cell(0, 5, _latin1(characters), align="C", new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(8)
+
+    pdf.set_font("Times", size=12)
+    for paragraph in story.history:
+        pdf.multi_cell(0, 6, _latin1(paragraph.strip()), align="J", new_x="LMARGIN", new_y="NEXT")
+        pdf.ln(3)
+    return bytes(pdf.output())
+
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+CONTENT_OPF = """<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id" xml:lang="{language}">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">urn:uuid:{identifier}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>{language}</dc:language>
+    <dc:creator>Tale Hopper</dc:creator>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="story" href="story.xhtml" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine>
+    <itemref idref="story"/>
+  </spine>
+</package>
+"""
+
+NAV_XHTML = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{language}">
+<head><title>{title}</title></head>
+<body>
+  <nav epub:type="toc"><ol><li><a href="story.xhtml">{title}</a></li></ol></nav>
+</body>
+</html>
+"""
+
+STORY_XHTML = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{language}">
+<head>
+  <title>{title}</title>
+  <style>h1 {{ text-align: center; }} .characters {{ text-align: center; font-style: italic; }}</style>
+</head>
+<body>
+  <h1>{title}</h1>
+{body}
+</body>
+</html>
+"""
+
+
+def render_epub(story: StoryExportRequest) -> bytes:
+    """ Package the story as a single-chapter EPUB 3 book. """
+    title = html.escape(story_title(story))
+    language = LABELS[story.prompt.language]["language"]
+    body = []
+    characters = _characters_line(story)
+    if characters:
+        body.append(f'  <p class="characters">{html.escape(characters)}</p>')
+    body.extend(f"  <p>{html.escape(paragraph.strip())}</p>" for paragraph in story.history)
+    # the same story always gets the same identifier:
+    identifier = uuid.uuid5(uuid.NAMESPACE_URL, story.model_dump_json())
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as epub:
+        # the mimetype must be the first entry, uncompressed:
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", CONTAINER_XML)
+        epub.writestr("OEBPS/content.opf", CONTENT_OPF.format(
+            identifier=identifier, title=title, language=language, modified=modified
+        ))
+        epub.writestr("OEBPS/nav.xhtml", NAV_XHTML.format(title=title, language=language))
+        epub.writestr("OEBPS/story.xhtml", STORY_XHTML.format(title=title, language=language, body="\n".join(body)))
+    return buffer.getvalue()
+
+
+RENDERERS = {"pdf": render_pdf, "epub": render_epub}
+
+
+def render(story: StoryExportRequest, format: str) -> bytes:
+    """ Entry point of the export worker processes. """
+    return RENDERERS[format](story)
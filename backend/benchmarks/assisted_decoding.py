@@ -0,0 +1,82 @@
+""" Compares the decoding throughput (tokens/sec) of the local HuggingFace model with
+    plain decoding and with assisted decoding (a draft model proposing tokens which the
+    main model verifies in batches), on the prompts of the story corpus.
+    Needs torch and the models (LLM_HUGGINGFACE_MODEL and the draft model) downloaded.
+
+    Usage (from the backend folder):
+        python -m benchmarks.assisted_decoding --draft-model <model> [--repeat 2]
+"""
+import argparse
+import os
+import statistics
+import threading
+from typing import List
+from pydantic import TypeAdapter
+from transformers import set_seed
+from app.core.config import settings
+from app.schemas import StoryRequest
+from app.services.generation_budget import generation_budget
+from app.services.story_generator import LLM_SYSTEM_PROMPT, StageManager, build_story_prompt
+from app.workers import hf_model
+from benchmarks.report import print_table
+
+BENCHMARKS_DIR = os.path.dirname(__file__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=settings.LLM_HUGGINGFACE_MODEL)
+    parser.add_argument("--draft-model", default=settings.LLM_HUGGINGFACE_DRAFT_MODEL)
+    parser.add_argument("--corpus", default=os.path.join(BENCHMARKS_DIR, "story_corpus.json"))
+    parser.add_argument("--repeat", type=int, default=2, help="number of runs of each prompt in each mode")
+    args = parser.parse_args()
+    if not args.draft_model:
+        parser.error("--draft-model (or LLM_HUGGINGFACE_DRAFT_MODEL) is required")
+
+    with open(args.corpus, encoding="utf-8") as file:
+        corpus = TypeAdapter(List[StoryRequest]).validate_json(file.read())
+    hf_model.load(args.model)
+    hf_model.load_draft(args.draft_model)
+    cancel_event = threading.Event()
+
+    results = {False: [], True: []}
+    for i, request in enumerate(corpus):
+        stage_manager = StageManager(request.prompt.length, request.stage_plan)
+        history_length = len(request.history)
+        prompt = build_story_prompt(request.prompt, request.history, request.choice, stage_manager.get_stage_guidance(history_length))
+        max_tokens = generation_budget.max_tokens_for(request.prompt, request.history, stage_manager.get_stage(history_length))
+        for run in range(args.repeat):
+            for assisted in (False, True):
+                # same sampling seed in both modes, assisted decoding then yields the same distribution:
+                set_seed(i * args.repeat + run)
+                results[assisted].append(hf_model.generate(
+                    args.model,
+                    f"{LLM_SYSTEM_PROMPT}\n\n{prompt}",
+                    max_new_tokens=max_tokens,
+                    cancel_event=cancel_event,
+                    draft_model=args.draft_model if assisted else None
+                ))
+
+    rows = []
+    throughputs = {}
+    for assisted, runs in results.items():
+        tokens = sum(result["completion_tokens"] for result in runs)
+        seconds = sum(result["decode_ms"] for result in runs) / 1000
+        throughputs[assisted] = tokens / seconds
+        steps = sum(result["main_model_steps"] for result in runs)
+        draft_tokens = sum(result["draft_tokens"] for result in runs)
+        rows.append([
+            "assisted" if assisted else "plain",
+            f"{statistics.mean(result['completion_tokens'] for result in runs):.0f}",
+            f"{throughputs[assisted]:.1f}",
+            f"{tokens / steps:.2f}",
+            f"{(tokens - steps) / draft_tokens:.1%}" if draft_tokens else "-",
+        ])
+
+    print(f"{len(corpus)} prompts x {args.repeat} runs, model {args.model}, draft model {args.draft_model}\n")
+    print_table(["mode", "tokens", "tokens/sec", "tokens/main pass", "draft acceptance"], rows)
+    print(f"\nspeedup: {throughputs[True] / throughputs[False]:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
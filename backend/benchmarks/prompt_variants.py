@@ -0,0 +1,197 @@
+""" Runs prompt variants over a fixed corpus of story requests and reports, side by side,
+    the prompt size, completion length, latency and rate of unparsable responses.
+
+    Variants are declared in a JSON file (see prompt_variants.json), each one can replace
+    the system prompt, substitute text in the story prompt, remove lines from it or append
+    instructions to it. Backends:
+    - simulated: offline, canned responses with simulated latencies
+    - replay: offline, responses recorded from a live run (--record)
+    - live: the LLM configured in .env (LLM_METHOD)
+
+    Usage (from the backend folder):
+        python -m benchmarks.prompt_variants --backend live --record benchmarks/replay.jsonl
+        python -m benchmarks.prompt_variants --backend replay --replay benchmarks/replay.jsonl
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from pydantic import BaseModel, TypeAdapter
+from app.core.config import settings
+from app.schemas import StoryRequest
+from app.services import story_generator
+from app.services.generation_budget import estimate_tokens, generation_budget
+from app.services.story_generator import StageManager, StoryGeneratorException, build_story_prompt, parse_story_json
+from benchmarks.report import percentile, print_table
+from benchmarks.simulated_llm import (
+    DEFAULT_PROFILES,
+    RecordedResponse,
+    ReplayMissException,
+    ReplayOpenAIClient,
+    SimulatedOpenAIClient,
+    record,
+    replay_key,
+)
+
+BENCHMARKS_DIR = os.path.dirname(__file__)
+DEFAULT_SYSTEM_PROMPT = story_generator.LLM_SYSTEM_PROMPT
+
+
+class PromptVariant(BaseModel):
+    name: str
+    description: str = ""
+    system_prompt: Optional[str] = None     # replaces LLM_SYSTEM_PROMPT
+    replace: Dict[str, str] = {}            # text substitutions in the story prompt
+    remove: List[str] = []                  # lines of the story prompt containing any of these are removed
+    append: List[str] = []                  # lines added at the end of the story prompt
+
+    def apply(self, prompt: str) -> str:
+        for old, new in self.replace.items():
+            prompt = prompt.replace(old, new)
+        lines = [line for line in prompt.split("\n") if not any(text in line for text in self.remove)]
+        return "\n".join(lines + self.append)
+
+    def unmatched(self, prompts: List[str]) -> List[str]:
+        """ Return the replacements/removals matching none of `prompts` (probably stale). """
+        return [text for text in list(self.replace) + self.remove if not any(text in prompt for prompt in prompts)]
+
+
+@dataclass
+class Sample:
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    valid: bool
+
+
+def is_valid_story(text: str, with_choices: bool) -> bool:
+    """ Whether `text` parses the way `llm_generate_story` expects it. """
+    try:
+        parse_story_json(text, with_choices)
+    except StoryGeneratorException:
+        return False
+    return True
+
+
+def build_prompt(request: StoryRequest) -> str:
+    stage_manager = StageManager(request.prompt.length, request.stage_plan)
+    stage_guidance = stage_manager.get_stage_guidance(len(request.history))
+    return build_story_prompt(request.prompt, request.history, request.choice, stage_guidance)
+
+
+async def run_variant(
+    variant: PromptVariant,
+    corpus: List[StoryRequest],
+    repeat: int,
+    concurrency: int,
+    record_path: Optional[str] = None
+) -> List[Sample]:
+    system_prompt = variant.system_prompt or DEFAULT_SYSTEM_PROMPT
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(request: StoryRequest) -> Sample:
+        prompt = variant.apply(build_prompt(request))
+        stage = StageManager(request.prompt.length, request.stage_plan).get_stage(len(request.history))
+        max_tokens = generation_budget.max_tokens_for(request.prompt, request.history, stage)
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                completion, model = await story_generator.llm_get_story_json(prompt, max_tokens)
+            except (StoryGeneratorException, ReplayMissException) as exc:
+                # counted as a failure of the variant, the other samples still run:
+                logging.warning(f"Variant {variant.name}: LLM call failed: {str(exc)}")
+                return Sample(estimate_tokens(system_prompt + prompt), 0, time.perf_counter() - start, False)
+            latency = time.perf_counter() - start
+        if record_path:
+            record(
+                record_path,
+                replay_key(model, system_prompt, prompt),
+                RecordedResponse(completion.text, completion.completion_tokens, latency)
+            )
+        with_choices = len(request.history) < request.prompt.length - 1
+        # reported by live LLMs, estimated by the simulated and replayed ones:
+        return Sample(
+            completion.prompt_tokens,
+            completion.completion_tokens,
+            latency,
+            is_valid_story(completion.text, with_choices)
+        )
+
+    # the backends read the system prompt from the module:
+    story_generator.LLM_SYSTEM_PROMPT = system_prompt
+    try:
+        return await asyncio.gather(*(run(request) for request in corpus for _ in range(repeat)))
+    finally:
+        story_generator.LLM_SYSTEM_PROMPT = DEFAULT_SYSTEM_PROMPT
+
+
+def setup_backend(args):
+    if args.backend == "live":
+        story_generator.initialize()
+        return
+    settings.LLM_METHOD = "openai"
+    if args.backend == "simulated":
+        story_generator.openai_client = SimulatedOpenAIClient(DEFAULT_PROFILES, malformed_rate=args.malformed_rate)
+    else:
+        story_generator.openai_client = ReplayOpenAIClient(args.replay)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--variants", default=os.path.join(BENCHMARKS_DIR, "prompt_variants.json"))
+    parser.add_argument("--corpus", default=os.path.join(BENCHMARKS_DIR, "story_corpus.json"))
+    parser.add_argument("--only", nargs="*", help="names of the variants to run (default: all)")
+    parser.add_argument("--backend", choices=["simulated", "replay", "live"], default="simulated")
+    parser.add_argument("--replay", help="file of recorded responses, for the replay backend")
+    parser.add_argument("--record", help="file to record the live responses to, for later replay")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each corpus entry")
+    parser.add_argument("--concurrency", type=int, default=4, help="max number of concurrent LLM calls")
+    parser.add_argument("--malformed-rate", type=float, default=0.05, help="ratio of malformed simulated responses")
+    args = parser.parse_args()
+    if args.backend == "replay" and not args.replay:
+        parser.error("--replay is required with the replay backend")
+    if args.record and args.backend != "live":
+        parser.error("--record is only supported with the live backend")
+    logging.disable(logging.INFO)
+
+    with open(args.variants, encoding="utf-8") as file:
+        variants = TypeAdapter(List[PromptVariant]).validate_json(file.read())
+    with open(args.corpus, encoding="utf-8") as file:
+        corpus = TypeAdapter(List[StoryRequest]).validate_json(file.read())
+    if args.only:
+        variants = [variant for variant in variants if variant.name in args.only]
+
+    base_prompts = [build_prompt(request) for request in corpus]
+    for variant in variants:
+        for text in variant.unmatched(base_prompts):
+            print(f"warning: '{text}' of variant {variant.name} matches no prompt of the corpus")
+
+    setup_backend(args)
+    rows = []
+    try:
+        for variant in variants:
+            samples = await run_variant(variant, corpus, args.repeat, args.concurrency, args.record)
+            latencies = [sample.latency for sample in samples]
+            rows.append([
+                variant.name,
+                f"{statistics.mean(sample.prompt_tokens for sample in samples):.0f}",
+                f"{statistics.mean(sample.completion_tokens for sample in samples):.0f}",
+                f"{percentile(latencies, 0.5):.3f}s",
+                f"{percentile(latencies, 0.95):.3f}s",
+                f"{sum(not sample.valid for sample in samples) / len(samples):.1%}",
+            ])
+    finally:
+        story_generator.shutdown()
+
+    print(f"{len(corpus)} corpus entries x {args.repeat} runs per variant, {args.backend} backend\n")
+    # the simulated and replayed responses don't report their usage:
+    prompt_tokens_header = "prompt tok" if args.backend == "live" else "prompt tok (est.)"
+    print_table(["variant", prompt_tokens_header, "completion tok", "p50", "p95", "parse failures"], rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,17 @@
+from typing import List, Sequence
+
+
+def percentile(values: Sequence[float], ratio: float) -> float:
+    """ Nearest-rank percentile of `values`, eg: ratio=0.95 for the p95. """
+    values = sorted(values)
+    return values[min(len(values) - 1, int(ratio * len(values)))]
+
+
+def print_table(headers: List[str], rows: List[List[str]]):
+    """ Print `rows` as a plain text table, first column left aligned and the others right aligned. """
+    widths = [max(len(str(row[i])) for row in [headers] + rows) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print("  ".join(
+            str(cell).ljust(width) if i == 0 else str(cell).rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        ))
@@ -0,0 +1,79 @@
+""" Micro-benchmarks of the story request/response serialization at several history sizes:
+    the default FastAPI path (json.loads + validation, jsonable_encoder + json.dumps) against
+    the optimized one (model_validate_json, pydantic-core serialization), plus the cost and
+    gain of compressing the response.
+
+    Usage (from the backend folder): python -m benchmarks.serialization
+"""
+import argparse
+import json
+import timeit
+from fastapi.encoders import jsonable_encoder
+from app.core.compression import compress
+from app.schemas import StoryPrompt, StoryRequest, StoryResponse
+from benchmarks.report import print_table
+
+PARAGRAPH = (
+    "Alice and Bob tiptoed into the dark cave, holding their lantern high. Drops of water echoed "
+    "like tiny drums all around them. Suddenly, a soft glow appeared behind a curtain of shiny rocks. "
+    "A little dragon with purple scales was sleeping on a pile of golden leaves."
+)
+
+
+def payloads(history_size: int):
+    history = [f"{i}. {PARAGRAPH}" for i in range(history_size)]
+    request = StoryRequest(
+        prompt=StoryPrompt(age=8, language="english", length=60, environment="forest", theme="friendship"),
+        history=history,
+        choice="Say hello to the dragon" if history else None,
+        stage_plan={"Introduction": 6, "Rising Action": 30, "Climax": 14, "Resolution": 10},
+    )
+    response = StoryResponse(
+        history=history + [PARAGRAPH],
+        choices=["Say hello to the dragon", "Sneak back out of the cave"],
+        stage_plan=request.stage_plan,
+    )
+    return json.dumps(request.model_dump()).encode(), response
+
+
+def per_call_us(fn) -> float:
+    number, _ = timeit.Timer(fn).autorange()
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--history-sizes", type=int, nargs="*", default=[0, 10, 30, 60])
+    args = parser.parse_args()
+
+    rows = []
+    for history_size in args.history_sizes:
+        body, response = payloads(history_size)
+        encoded = response.__pydantic_serializer__.to_json(response)
+        parse_before = per_call_us(lambda: StoryRequest.model_validate(json.loads(body)))
+        parse_after = per_call_us(lambda: StoryRequest.model_validate_json(body))
+        # what FastAPI's JSONResponse does with the endpoint's return value:
+        encode_before = per_call_us(lambda: json.dumps(
+            jsonable_encoder(response), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode())
+        encode_after = per_call_us(lambda: response.__pydantic_serializer__.to_json(response))
+        gzip_size = len(compress(encoded, "gzip"))
+        br_size = len(compress(encoded, "br"))
+        rows.append([
+            str(history_size),
+            f"{len(body) / 1024:.1f}",
+            f"{parse_before:.0f} -> {parse_after:.0f}",
+            f"{encode_before:.0f} -> {encode_after:.0f}",
+            f"{len(encoded) / 1024:.1f}",
+            f"{gzip_size / 1024:.1f} ({per_call_us(lambda: compress(encoded, 'gzip')):.0f}us)",
+            f"{br_size / 1024:.1f} ({per_call_us(lambda: compress(encoded, 'br')):.0f}us)",
+        ])
+
+    print_table(
+        ["history", "request KB", "parse us", "encode us", "response KB", "gzip KB", "brotli KB"],
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main()
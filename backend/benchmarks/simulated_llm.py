@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import json
+import random
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+
+@dataclass
+class ModelProfile:
+    time_to_first_token: float  # seconds
+    time_per_token: float       # seconds
+
+
+# rough latencies of a large and a small hosted model:
+DEFAULT_PROFILES = {
+    "large": ModelProfile(time_to_first_token=0.4, time_per_token=0.02),
+    "small": ModelProfile(time_to_first_token=0.15, time_per_token=0.005),
+}
+
+SENTENCES = [
+    "Alice and Bob tiptoed into the dark cave, holding their lantern high.",
+    "Drops of water echoed like tiny drums all around them.",
+    "Suddenly, a soft glow appeared behind a curtain of shiny rocks.",
+    "Bob's ears twitched as he heard a gentle humming sound.",
+    "The friends looked at each other and smiled bravely.",
+    "A little dragon with purple scales was sleeping on a pile of golden leaves.",
+    "It opened one sleepy eye and yawned a puff of warm, sparkly smoke.",
+]
+CHOICES = ["Say hello to the dragon", "Sneak back out of the cave", "Look for the source of the humming"]
+
+
+class _SimulatedStream:
+    """ Mimics the async stream of the OpenAI client, one token (~4 characters by default) per chunk. """
+    def __init__(self, content: str, profile: ModelProfile, chunk_size: int = 4):
+        self.content = content
+        self.profile = profile
+        self.chunk_size = chunk_size
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def __aiter__(self):
+        await asyncio.sleep(self.profile.time_to_first_token)
+        for i in range(0, len(self.content), self.chunk_size):
+            chunk = self.content[i:i + self.chunk_size]
+            # no usage chunk at the end, the prompt tokens are estimated:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=chunk))], usage=None)
+            await asyncio.sleep(self.profile.time_per_token)
+
+
+class SimulatedOpenAIClient:
+    """ Stand-in for `AsyncOpenAI` streaming story responses with the latency profile of
+        the requested model (models not listed in `profiles` use the "large" profile).
+    """
+    def __init__(
+        self,
+        profiles: Dict[str, ModelProfile],
+        paragraph_sentences: int = 6,
+        malformed_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.profiles = profiles
+        self.paragraph_sentences = paragraph_sentences
+        self.malformed_rate = malformed_rate    # ratio of responses cut in the middle of the JSON
+        self.random = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _paragraph(self) -> str:
+        return " ".join(self.random.sample(SENTENCES, self.paragraph_sentences))
+
+    def respond(self, prompt: str) -> str:
+        """ Return the response the story prompts ask for. """
+        if "JSON list of strings" in prompt:
+            response = json.dumps(CHOICES)
+        elif "choices" in prompt:
+            response = json.dumps({"paragraph": self._paragraph(), "choices": CHOICES})
+        else:
+            response = json.dumps({"paragraph": self._paragraph()})
+        if self.random.random() < self.malformed_rate:
+            response = response[:self.random.randrange(1, len(response))]
+        return response
+
+    async def create(self, model: str, messages: List[dict], stream: bool = True, **kwargs):
+        profile = self.profiles.get(model, self.profiles["large"])
+        return _SimulatedStream(self.respond(messages[-1]["content"]), profile)
+
+
+class ReplayMissException(Exception):
+    pass
+
+
+def replay_key(model: str, system_prompt: str, prompt: str) -> str:
+    return hashlib.sha256(json.dumps([model, system_prompt, prompt]).encode()).hexdigest()
+
+
+@dataclass
+class RecordedResponse:
+    text: str
+    completion_tokens: int
+    latency: float      # seconds
+
+
+class ReplayOpenAIClient:
+    """ Stand-in for `AsyncOpenAI` streaming responses recorded from a live backend
+        (see `record`), spread over their recorded latency.
+    """
+    def __init__(self, path: str):
+        self.responses: Dict[str, RecordedResponse] = {}
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                key = record.pop("key")
+                self.responses[key] = RecordedResponse(**record)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def get(self, model: str, messages: List[dict]) -> Optional[RecordedResponse]:
+        return self.responses.get(replay_key(model, messages[0]["content"], messages[-1]["content"]))
+
+    async def create(self, model: str, messages: List[dict], stream: bool = True, **kwargs):
+        response = self.get(model, messages)
+        if response is None:
+            raise ReplayMissException(f"No recorded response for this prompt and model {model}, record it first")
+        tokens = max(1, response.completion_tokens)
+        profile = ModelProfile(time_to_first_token=0, time_per_token=response.latency / tokens)
+        return _SimulatedStream(response.text, profile, chunk_size=max(1, -(-len(response.text) // tokens)))
+
+
+def record(path: str, key: str, response: RecordedResponse):
+    """ Append a live response to the replay file at `path`. """
+    with open(path, "a", encoding="utf-8") as file:
+        file.write(json.dumps({"key": key, **response.__dict__}) + "\n")
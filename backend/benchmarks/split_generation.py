@@ -0,0 +1,70 @@
+""" Compares the end-to-end latency of a story step in single-call mode (the main model
+    writes the paragraph and the choices) and in split generation mode (the main model
+    writes the paragraph, a small model the choices), against a simulated OpenAI backend.
+
+    Usage (from the backend folder): python -m benchmarks.split_generation [--requests 20]
+"""
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.schemas import StoryPrompt, StoryRequest
+from app.services import story_generator
+from benchmarks.report import percentile
+from benchmarks.simulated_llm import DEFAULT_PROFILES, SimulatedOpenAIClient
+
+# the main model (LLM_OPENAI_MODEL) is simulated with the "large" profile
+CHOICES_MODEL = "small"
+
+
+async def run(split: bool, requests: int, concurrency: int):
+    settings.LLM_METHOD = "openai"
+    settings.STORY_SPLIT_GENERATION = split
+    settings.LLM_CHOICES_METHOD = "openai"
+    settings.LLM_CHOICES_MODEL = CHOICES_MODEL
+    story_generator.openai_client = SimulatedOpenAIClient(DEFAULT_PROFILES)
+
+    request = StoryRequest(
+        prompt=StoryPrompt(age=8, language="english", length=10),
+        history=["Once upon a time, Alice and Bob went on an adventure."],
+        choice="Explore the cave",
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            step = await story_generator.llm_generate_story(request)
+            latencies.append(time.perf_counter() - start)
+            assert step.choices
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(f"{'mode':<8} {'mean':>8} {'p50':>8} {'p95':>8}")
+    for split in (False, True):
+        latencies = await run(split, args.requests, args.concurrency)
+        print(
+            f"{'split' if split else 'single':<8} {statistics.mean(latencies):>7.3f}s "
+            f"{percentile(latencies, 0.5):>7.3f}s {percentile(latencies, 0.95):>7.3f}s"
+        )
+    print(
+        f"speculative choices calls: {metrics.get('split_choices_speculative_calls')}, "
+        f"used: {metrics.get('split_choices_speculation_hits')}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import asyncio
+import csv
+import io
+import json
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from app.schemas.feedback import FeedbackRequest
+from app.services.feedback_store import FeedbackStore
+from app.services.token_ledger import SCHEMA, TokenLedger, TokenUsage
+
+ADMIN_HEADERS = {"X-Admin-Key": "secret"}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FeedbackStore(str(tmp_path / "feedback.db"), batch_size=10, flush_interval=0.01)
+
+    async def fill():
+        await store.start()
+        for i in range(5):
+            store.add(FeedbackRequest(message=f"Feedback {i}, about the forest story", email="parent@example.com"))
+        await store.stop()
+
+    asyncio.run(fill())
+    with patch("app.api.routes.admin.feedback_store", store), \
+         patch("app.core.security.settings.ADMIN_API_KEY", "secret"):
+        yield store
+
+
+def test_admin_routes_require_admin_key(client: TestClient, store):
+    assert client.get("/admin/feedback").status_code == 403
+    assert client.get("/admin/feedback", headers={"X-Admin-Key": "wrong"}).status_code == 403
+
+
+def test_list_feedback_pages(client: TestClient, store):
+    response = client.get("/admin/feedback", params={"limit": 3}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    page = response.json()
+    assert [item["message"] for item in page["items"]] == [f"Feedback {i}, about the forest story" for i in (4, 3, 2)]
+
+    response = client.get(
+        "/admin/feedback",
+        params={"limit": 3, "before_id": page["next_cursor"], "q": "forest"},
+        headers=ADMIN_HEADERS
+    )
+    page = response.json()
+    assert len(page["items"]) == 2
+    assert page["next_cursor"] is None
+
+
+def test_export_feedback(client: TestClient, store):
+    response = client.get("/admin/feedback/export", params={"format": "ndjson"}, headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert len(records) == 5
+
+    response = client.get("/admin/feedback/export", params={"format": "csv"}, headers=ADMIN_HEADERS)
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["id", "created_at", "email", "message"]
+    assert rows[1][3] == "Feedback 4, about the forest story"
+    assert len(rows) == 6
+
+
+def test_token_usage(client: TestClient, tmp_path):
+    ledger = TokenLedger(str(tmp_path / "tokens.db"), 1000, 5000, batch_size=100, flush_interval=60, retention_days=30)
+    with patch("app.api.routes.admin.token_ledger", ledger), \
+         patch("app.core.security.settings.ADMIN_API_KEY", "secret"):
+        assert client.get("/admin/tokens").status_code == 403
+
+        ledger._connection = ledger._connect()
+        ledger._connection.executescript(SCHEMA)
+        ledger.record("1.2.3.4", "story-a", "model", TokenUsage(300, 50))
+        ledger.record("1.2.3.4", "story-b", "model", TokenUsage(500, 80))
+        # pending records are included:
+        response = client.get("/admin/tokens", params={"scope": "story"}, headers=ADMIN_HEADERS)
+        assert response.status_code == 200
+        page = response.json()
+        assert page["budget"] == 1000
+        assert [(item["key"], item["total_tokens"]) for item in page["items"]] == [("story-b", 580), ("story-a", 350)]
+
+        response = client.get("/admin/tokens", headers=ADMIN_HEADERS)
+        assert [(item["key"], item["requests"]) for item in response.json()["items"]] == [("1.2.3.4", 2)]
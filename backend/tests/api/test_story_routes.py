@@ -1,16 +1,23 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch, PropertyMock
+from app import schemas
 from app.main import app
+from app.core.metrics import metrics
+from app.services.token_ledger import story_key, token_ledger
+from app.services.story_generator import StoryStep
 from fastapi import Request
 
 
 
+STAGE_PLAN = {"Introduction": 1, "Rising Action": 2, "Climax": 1, "Resolution": 1}
+
 @pytest.fixture
 def mock_story_generator():
     with patch('app.api.routes.story.llm_generate_story',
-               return_value=("Test paragraph", ["Choice 1", "Choice 2", "Choice 3"])):
-        yield
+               return_value=StoryStep("Test paragraph", ["Choice 1", "Choice 2", "Choice 3"], STAGE_PLAN, "test-model")) as mock:
+        yield mock
 
 @pytest.fixture
 def story_request_payload():
@@ -34,14 +41,16 @@ def test_rate_limit_enforcement(client: TestClient, mock_story_generator, story_
         # Set up the mock client.host property
         type(mock_client).host = PropertyMock(return_value='127.0.0.1')
         
-        # Simulate 10 successful requests
-        for _ in range(10):
+        # Simulate 10 successful requests (distinct, so they aren't coalesced as duplicates)
+        for i in range(10):
+            story_request_payload["prompt"]["prompt"] = f"Story {i}"
             response = client.post('/story/generate', json=story_request_payload)
             assert response.status_code == 200
             assert 'history' in response.json()
             assert 'choices' in response.json()
 
         # 11th request should be rate limited
+        story_request_payload["prompt"]["prompt"] = "Story 10"
         response = client.post('/story/generate', json=story_request_payload)
         assert response.status_code == 429
         assert response.json()['detail'] == 'Rate limit exceeded. Please slow down.'
@@ -59,11 +68,13 @@ def test_rate_limit_different_ip(client: TestClient, mock_story_generator, story
         type(mock_client).host = PropertyMock(return_value='127.0.0.2')
         
         # Make 10 successful requests
-        for _ in range(10):
+        for i in range(10):
+            story_request_payload["prompt"]["prompt"] = f"Other story {i}"
             response = client.post('/story/generate', json=story_request_payload)
             assert response.status_code == 200
 
         # 11th request from first IP should be rate limited
+        story_request_payload["prompt"]["prompt"] = "Other story 10"
         response = client.post('/story/generate', json=story_request_payload)
         assert response.status_code == 429
 
@@ -75,3 +86,164 @@ def test_rate_limit_different_ip(client: TestClient, mock_story_generator, story
         
         response = client.post('/story/generate', json=story_request_payload)
         assert response.status_code == 200  # This request should succeed as it's from a different IP
+
+
+def test_generation_deadline_returns_504(client: TestClient, story_request_payload):
+    """
+    Test that the story generation is cancelled once the request deadline is reached.
+    """
+    cancelled = False
+
+    async def slow_generation(story_request):
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    with patch('app.api.routes.story.llm_generate_story', side_effect=slow_generation), \
+         patch('app.api.routes.story.settings.STORY_REQUEST_DEADLINE', 0.1), \
+         patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.4')
+
+        response = client.post('/story/generate', json=story_request_payload)
+        assert response.status_code == 504
+        assert cancelled
+        assert metrics.get("story_cancelled_deadline") >= 1
+
+
+def test_duplicate_requests_are_coalesced(client: TestClient, mock_story_generator, story_request_payload):
+    """
+    Test that identical requests share one LLM call and don't consume rate-limit quota.
+    """
+    story_request_payload["prompt"]["prompt"] = "A duplicated story"
+    with patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.5')
+
+        for _ in range(15):
+            response = client.post('/story/generate', json=story_request_payload)
+            assert response.status_code == 200
+            assert response.json()['history'] == ["Test paragraph"]
+            assert response.headers['X-Model-Tier'] == "test-model"
+
+        assert mock_story_generator.call_count == 1
+
+
+def test_invalid_story_request_returns_422(client: TestClient, mock_story_generator, story_request_payload):
+    """
+    Test that the body validated from raw bytes keeps FastAPI's validation error format.
+    """
+    story_request_payload["prompt"]["age"] = 42
+    with patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.6')
+        response = client.post('/story/generate', json=story_request_payload)
+        assert response.status_code == 422
+        assert response.json()['detail'][0]['loc'] == ['body', 'prompt', 'age']
+
+        response = client.post('/story/generate', content=b'{"prompt": ', headers={"Content-Type": "application/json"})
+        assert response.status_code == 422
+        assert not mock_story_generator.called
+
+
+def test_large_story_response_is_compressed(client: TestClient, mock_story_generator, story_request_payload):
+    """
+    Test that long story responses are compressed when the client accepts it.
+    """
+    story_request_payload["prompt"]["length"] = 60
+    story_request_payload["history"] = [f"Paragraph {i} of a long story about a brave little fox." for i in range(40)]
+    story_request_payload["choice"] = "Follow the fox"
+    with patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.7')
+        response = client.post('/story/generate', json=story_request_payload, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers['Content-Encoding'] == "gzip"
+        assert response.headers['X-Model-Tier'] == "test-model"
+        assert response.json()['history'][-1] == "Test paragraph"
+        assert len(response.json()['history']) == 41
+
+
+def test_story_request_body_is_documented(client: TestClient):
+    schema = client.get('/openapi.json').json()
+    body = schema['paths']['/story/generate']['post']['requestBody']['content']['application/json']['schema']
+    assert set(body['properties']) == {"prompt", "history", "choice", "stage_plan"}
+
+
+def test_export_story(client: TestClient, story_request_payload, tmp_path):
+    """
+    Test that finished stories are exported as files, and unfinished ones refused.
+    """
+    export_path = tmp_path / "story.epub"
+    export_path.write_bytes(b"epub content")
+    story_request_payload["history"] = [f"Paragraph {i}" for i in range(5)]
+    story_request_payload["title"] = 'The "brave" fox'
+    with patch('app.api.routes.story.story_exporter.export', return_value=str(export_path)) as mock_export, \
+         patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.8')
+        response = client.post('/story/export', params={"format": "epub"}, json=story_request_payload)
+        assert response.status_code == 200
+        assert response.content == b"epub content"
+        assert response.headers['Content-Type'] == "application/epub+zip"
+        assert response.headers['Content-Disposition'] == "attachment; filename*=utf-8''The%20brave%20fox.epub"
+        assert mock_export.call_args.args[1] == "epub"
+
+        story_request_payload["history"] = story_request_payload["history"][:3]
+        response = client.post('/story/export', json=story_request_payload)
+        assert response.status_code == 400
+        assert mock_export.call_count == 1
+
+
+def test_export_is_not_compressed_again(client: TestClient, story_request_payload, tmp_path):
+    """
+    Test that exports, which are already compressed, are sent as is, ranges included.
+    """
+    export_path = tmp_path / "story.pdf"
+    export_path.write_bytes(b"%PDF" + b"x" * 4096)
+    story_request_payload["history"] = [f"Paragraph {i}" for i in range(5)]
+    with patch('app.api.routes.story.story_exporter.export', return_value=str(export_path)), \
+         patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.10')
+        response = client.post('/story/export', json=story_request_payload, headers={"Accept-Encoding": "br, gzip"})
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        assert response.content == export_path.read_bytes()
+
+        response = client.post(
+            '/story/export',
+            json=story_request_payload,
+            headers={"Accept-Encoding": "br, gzip", "Range": "bytes=0-2047"}
+        )
+        assert response.status_code == 206
+        assert "Content-Encoding" not in response.headers
+        assert response.content == export_path.read_bytes()[:2048]
+
+
+def test_story_token_budget(client: TestClient, story_request_payload):
+    """
+    Test that the tokens of each step are recorded, and that stories over their budget are refused.
+    """
+    async def generate(story_request):
+        token_ledger.count(600, 100)
+        return StoryStep("First paragraph", ["Choice 1"], STAGE_PLAN, "test-model")
+
+    with patch('app.api.routes.story.llm_generate_story', side_effect=generate), \
+         patch.object(token_ledger, 'story_budget', 94_500), \
+         patch.object(Request, 'client') as mock_client:
+        type(mock_client).host = PropertyMock(return_value='127.0.0.9')
+        story_request_payload["prompt"]["prompt"] = "A story on a budget"
+        assert token_ledger.story_budget_for(story_request_payload["prompt"]["length"]) == 1000
+        response = client.post('/story/generate', json=story_request_payload)
+        assert response.status_code == 200
+        story = story_key(schemas.StoryPrompt(**story_request_payload["prompt"]), "First paragraph")
+        assert token_ledger.used("story", story) == 700
+
+        story_request_payload["history"] = ["First paragraph"]
+        story_request_payload["choice"] = "Choice 1"
+        response = client.post('/story/generate', json=story_request_payload)
+        assert response.status_code == 200
+        assert token_ledger.used("story", story) == 1400
+
+        story_request_payload["history"].append("First paragraph")
+        response = client.post('/story/generate', json=story_request_payload)
+        assert response.status_code == 429
+        assert "token budget" in response.json()['detail']
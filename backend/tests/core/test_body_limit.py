@@ -0,0 +1,37 @@
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from app.core.body_limit import BodySizeLimitMiddleware
+
+app = FastAPI()
+app.add_middleware(BodySizeLimitMiddleware, max_body_size=100)
+
+
+@app.post("/echo")
+async def echo(request: Request):
+    return {"size": len(await request.body())}
+
+
+client = TestClient(app)
+
+
+def test_body_under_limit():
+    response = client.post("/echo", content=b"x" * 100)
+    assert response.status_code == 200
+    assert response.json() == {"size": 100}
+
+
+def test_content_length_over_limit():
+    response = client.post("/echo", content=b"x" * 101)
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large."}
+
+
+def test_chunked_body_over_limit():
+    def chunks():
+        for _ in range(10):
+            yield b"x" * 30
+
+    # no Content-Length: the limit is enforced as the chunks are received
+    response = client.post("/echo", content=chunks())
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large."}
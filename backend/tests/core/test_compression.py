@@ -0,0 +1,90 @@
+import brotli
+import gzip
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+from app.core.compression import CompressionMiddleware
+
+LARGE_TEXT = "Once upon a time, " * 200
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, encodings=["br", "gzip"], minimum_size=1024)
+
+
+@app.get("/large")
+def large():
+    return PlainTextResponse(LARGE_TEXT)
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("Once upon a time")
+
+
+@app.get("/stream")
+def stream():
+    return StreamingResponse(iter([LARGE_TEXT.encode(), LARGE_TEXT.encode()]), media_type="text/plain")
+
+
+@app.get("/image")
+def image():
+    return Response(b"\x89PNG" * 1000, media_type="image/png")
+
+
+@app.get("/partial")
+def partial():
+    return PlainTextResponse(LARGE_TEXT[:2048], status_code=206, headers={"Content-Range": f"bytes 0-2047/{len(LARGE_TEXT)}"})
+
+
+client = TestClient(app)
+
+
+def get_raw(path, accept_encoding):
+    """ Return the response without letting the client decode the body. """
+    with client.stream("GET", path, headers={"Accept-Encoding": accept_encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_brotli_preferred():
+    response, body = get_raw("/large", "gzip, deflate, br")
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) == len(body)
+    assert brotli.decompress(body).decode() == LARGE_TEXT
+
+
+def test_gzip_fallback():
+    response, body = get_raw("/large", "gzip")
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(body).decode() == LARGE_TEXT
+
+
+def test_small_response_not_compressed():
+    response, body = get_raw("/small", "gzip, br")
+    assert "Content-Encoding" not in response.headers
+    assert body == b"Once upon a time"
+
+
+def test_no_accepted_encoding():
+    response, body = get_raw("/large", "identity")
+    assert "Content-Encoding" not in response.headers
+    assert body.decode() == LARGE_TEXT
+
+
+def test_streamed_response_not_compressed():
+    response, body = get_raw("/stream", "gzip, br")
+    assert "Content-Encoding" not in response.headers
+    assert body.decode() == LARGE_TEXT * 2
+
+
+def test_compressed_media_type_not_compressed():
+    response, body = get_raw("/image", "gzip, br")
+    assert "Content-Encoding" not in response.headers
+    assert body == b"\x89PNG" * 1000
+
+
+def test_partial_response_not_compressed():
+    response, body = get_raw("/partial", "gzip, br")
+    assert response.status_code == 206
+    assert "Content-Encoding" not in response.headers
+    assert body.decode() == LARGE_TEXT[:2048]
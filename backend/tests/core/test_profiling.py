@@ -0,0 +1,22 @@
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+
+def test_profile_requires_admin_key(client: TestClient):
+    with patch("app.core.security.settings.ADMIN_API_KEY", "secret"):
+        response = client.get("/health", headers={"X-Profile": "1", "X-Admin-Key": "wrong"})
+    assert response.status_code == 403
+
+
+def test_profile_report_is_returned(client: TestClient):
+    with patch("app.core.security.settings.ADMIN_API_KEY", "secret"):
+        response = client.get("/health", headers={"X-Profile": "1", "X-Admin-Key": "secret"})
+    assert response.status_code == 200
+    assert response.headers["X-Profiled-Status"] == "200"
+    assert response.text.startswith("# ")
+    assert "collapsed stacks" in response.text
+
+
+def test_no_profile_without_header(client: TestClient):
+    response = client.get("/health")
+    assert response.json() == {"status": "ok"}
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from app.core.single_flight import SingleFlight
+
+
+class TestSingleFlight:
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight("test", grace_period=0)
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        assert results == ["result"] * 5
+        assert calls == 1
+        assert not flight.has("key")
+
+    @pytest.mark.asyncio
+    async def test_different_keys_run_separately(self):
+        flight = SingleFlight("test", grace_period=0)
+
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(flight.do("a", lambda: work("a")), flight.do("b", lambda: work("b")))
+        assert results == ["a", "b"]
+
+    @pytest.mark.asyncio
+    async def test_result_is_kept_for_grace_period(self):
+        flight = SingleFlight("test", grace_period=0.1)
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await flight.do("key", work) == 1
+        assert flight.has("key")
+        assert await flight.do("key", work) == 1
+        await asyncio.sleep(0.15)
+        assert not flight.has("key")
+        assert await flight.do("key", work) == 2
+
+    @pytest.mark.asyncio
+    async def test_errors_are_shared_but_not_cached(self):
+        flight = SingleFlight("test", grace_period=10)
+
+        async def failing_work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            flight.do("key", failing_work),
+            flight.do("key", failing_work),
+            return_exceptions=True
+        )
+        assert all(isinstance(result, ValueError) for result in results)
+        assert not flight.has("key")
+
+    @pytest.mark.asyncio
+    async def test_shared_task_survives_until_last_caller_leaves(self):
+        flight = SingleFlight("test", grace_period=0)
+        started = asyncio.Event()
+        cancelled = False
+
+        async def work():
+            nonlocal cancelled
+            started.set()
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await started.wait()
+
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert not cancelled
+
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled
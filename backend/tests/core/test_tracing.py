@@ -0,0 +1,65 @@
+import asyncio
+import json
+import pytest
+from app.core.tracing import BatchSpanExporter, Tracer
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    return tmp_path / "traces.jsonl"
+
+@pytest.fixture
+def tracer(trace_file):
+    return Tracer(
+        enabled=True,
+        exporter=BatchSpanExporter("test-service", file_path=str(trace_file), otlp_endpoint=None)
+    )
+
+def read_spans(trace_file):
+    spans = []
+    for line in trace_file.read_text().splitlines():
+        payload = json.loads(line)
+        for resource_spans in payload["resourceSpans"]:
+            for scope_spans in resource_spans["scopeSpans"]:
+                spans.extend(scope_spans["spans"])
+    return {span["name"]: span for span in spans}
+
+
+class TestTracer:
+
+    def traced_work(self, tracer):
+        with tracer.span("in_thread"):
+            pass
+
+    @pytest.mark.asyncio
+    async def test_nested_spans_are_exported_as_otlp(self, tracer, trace_file):
+        with tracer.span("root", route="/story/generate"):
+            with tracer.span("child") as child:
+                child.set_attribute("tokens", 42)
+                # spans follow the request into other tasks and threads:
+                await asyncio.create_task(asyncio.to_thread(self.traced_work, tracer))
+        tracer.shutdown()
+
+        spans = read_spans(trace_file)
+        root, child = spans["root"], spans["child"]
+        assert child["traceId"] == root["traceId"]
+        assert child["parentSpanId"] == root["spanId"]
+        assert "parentSpanId" not in root
+        assert spans["in_thread"]["parentSpanId"] == child["spanId"]
+        assert {"key": "tokens", "value": {"intValue": "42"}} in child["attributes"]
+        assert int(root["endTimeUnixNano"]) >= int(child["endTimeUnixNano"])
+
+    def test_errors_are_recorded(self, tracer, trace_file):
+        with pytest.raises(ValueError):
+            with tracer.span("failing"):
+                raise ValueError("boom")
+        tracer.shutdown()
+
+        assert read_spans(trace_file)["failing"]["status"] == {"code": 2, "message": "ValueError: boom"}
+
+    def test_disabled_tracer_exports_nothing(self, trace_file):
+        tracer = Tracer(enabled=False, exporter=BatchSpanExporter("test", str(trace_file), None))
+        with tracer.span("noop") as span:
+            span.set_attribute("key", "value")
+        tracer.shutdown()
+        assert not trace_file.exists()
@@ -0,0 +1,51 @@
+import pytest
+from app.core.metrics import metrics
+from app.services.assisted_decoding import AssistedDecodingMonitor
+
+
+def result(assisted, tokens=100, decode_ms=1000.0, steps=100, draft_tokens=0, cancelled=False):
+    return {
+        "completion_tokens": tokens,
+        "decode_ms": decode_ms,
+        "assisted": assisted,
+        "main_model_steps": steps,
+        "draft_tokens": draft_tokens,
+        "cancelled": cancelled,
+    }
+
+
+class TestAssistedDecodingMonitor:
+    def test_no_draft_model(self):
+        monitor = AssistedDecodingMonitor(None, probe_rate=0.05)
+        assert monitor.pick_draft_model() is None
+
+    def test_probe_rate(self, mocker):
+        monitor = AssistedDecodingMonitor("draft", probe_rate=0.1)
+        mocker.patch("app.services.assisted_decoding.random.random", return_value=0.05)
+        assert monitor.pick_draft_model() is None
+        mocker.patch("app.services.assisted_decoding.random.random", return_value=0.5)
+        assert monitor.pick_draft_model() == "draft"
+
+    def test_speedup(self):
+        monitor = AssistedDecodingMonitor("draft", probe_rate=0.05)
+        monitor.observe(result(assisted=True, decode_ms=400.0, steps=40, draft_tokens=80))
+        assert monitor.speedup() is None
+        monitor.observe(result(assisted=False, decode_ms=1000.0))
+        assert monitor.speedup() == pytest.approx(2.5)
+        assert metrics.get("hf_assisted_speedup") == 2.5
+
+    def test_acceptance_rate(self):
+        proposed = metrics.get("hf_draft_tokens_proposed")
+        accepted = metrics.get("hf_draft_tokens_accepted")
+        monitor = AssistedDecodingMonitor("draft", probe_rate=0.05)
+        # 100 tokens in 40 main model passes: 60 of the 80 draft tokens were accepted
+        monitor.observe(result(assisted=True, steps=40, draft_tokens=80))
+        assert metrics.get("hf_draft_tokens_proposed") == proposed + 80
+        assert metrics.get("hf_draft_tokens_accepted") == accepted + 60
+        assert 0 < metrics.get("hf_draft_acceptance_rate") <= 1
+
+    def test_ignores_cancelled_generations(self):
+        monitor = AssistedDecodingMonitor("draft", probe_rate=0.05)
+        monitor.observe(result(assisted=False, cancelled=True))
+        monitor.observe(result(assisted=True, cancelled=True))
+        assert monitor.speedup() is None
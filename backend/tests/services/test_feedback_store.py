@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from app.schemas.feedback import FeedbackRequest
+from app.services.feedback_store import FeedbackStore
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    store = FeedbackStore(str(tmp_path / "feedback.db"), batch_size=10, flush_interval=0.01)
+    await store.start()
+    yield store
+    await store.stop()
+
+
+class TestFeedbackStore:
+
+    @pytest.mark.asyncio
+    async def test_feedback_is_written_in_batches(self, store):
+        for i in range(25):
+            store.add(FeedbackRequest(message=f"Feedback number {i}", email=f"parent{i}@example.com"))
+        await store.stop()
+
+        records = store.query(limit=100)
+        assert len(records) == 25
+        # newest first:
+        assert records[0].message == "Feedback number 24"
+        assert records[-1].message == "Feedback number 0"
+
+    @pytest.mark.asyncio
+    async def test_writer_survives_failed_batches(self, store):
+        write_batch = store._write_batch
+        with patch.object(store, '_write_batch', side_effect=ValueError("bad batch")) as mock_write:
+            store.add(FeedbackRequest(message="Lost feedback"))
+            while mock_write.call_count < 1:
+                await asyncio.sleep(0.01)
+            mock_write.side_effect = write_batch
+            store.add(FeedbackRequest(message="Stored feedback"))
+            await store.stop()
+
+        assert [record.message for record in store.query()] == ["Stored feedback"]
+
+    @pytest.mark.asyncio
+    async def test_keyword_search(self, store):
+        store.add(FeedbackRequest(message="My daughter loved the dragon story"))
+        store.add(FeedbackRequest(message="The app is too slow"))
+        store.add(FeedbackRequest(message='Please add more dragons! "NOT" AND (brackets)'))
+        await store.stop()
+
+        assert [r.message for r in store.query(keywords="slow")] == ["The app is too slow"]
+        # FTS5 syntax in the keywords must not break the query:
+        assert len(store.query(keywords="dragon* (")) == 1
+        assert len(store.query(keywords='"NOT" AND')) == 1
+        assert [r.message for r in store.query(keywords="daughter dragon")] == [
+            "My daughter loved the dragon story"
+        ]
+
+    @pytest.mark.asyncio
+    async def test_time_range_and_pagination(self, store):
+        for i in range(7):
+            store.add(FeedbackRequest(message=f"Feedback {i}"))
+        await store.stop()
+
+        now = datetime.now(timezone.utc)
+        assert len(store.query(start=now - timedelta(minutes=1), end=now + timedelta(minutes=1))) == 7
+        assert store.query(start=now + timedelta(minutes=1)) == []
+
+        first_page = store.query(limit=3)
+        second_page = store.query(before_id=first_page[-1].id, limit=3)
+        assert [r.message for r in first_page + second_page] == [f"Feedback {i}" for i in range(6, 0, -1)]
+        assert [r.message for r in store.iter_all(page_size=2)] == [f"Feedback {i}" for i in range(6, -1, -1)]
@@ -0,0 +1,91 @@
+import json
+import pytest
+from app.schemas.story import StoryPrompt
+from app.services.generation_budget import GenerationBudgetController, JsonObjectTracker
+
+
+class TestJsonObjectTracker:
+
+    def feed_chunks(self, tracker, text, chunk_size=3):
+        for i in range(0, len(text), chunk_size):
+            if tracker.feed(text[i:i + chunk_size]):
+                return True
+        return False
+
+    def test_detects_end_of_object(self):
+        story = json.dumps({"paragraph": "Once upon a time.", "choices": ["A", "B"]})
+        text = story + " I hope you like it! {not json}"
+        tracker = JsonObjectTracker()
+        assert self.feed_chunks(tracker, text)
+        assert tracker.extract(text) == story
+
+    def test_ignores_braces_and_quotes_in_strings(self):
+        story = json.dumps({"paragraph": 'The dragon said "}{" and laughed \\o/', "choices": ["[Run]"]})
+        tracker = JsonObjectTracker()
+        assert self.feed_chunks(tracker, story + "\n")
+        assert json.loads(tracker.extract(story + "\n")) == json.loads(story)
+
+    def test_skips_text_before_the_object(self):
+        story = json.dumps({"paragraph": "Hello", "choices": []})
+        text = f'Here is your "story":\n```json\n{story}\n```'
+        tracker = JsonObjectTracker()
+        assert self.feed_chunks(tracker, text)
+        assert tracker.extract(text) == story
+
+    def test_incomplete_object(self):
+        text = '{"paragraph": "Once upon'
+        tracker = JsonObjectTracker()
+        assert not self.feed_chunks(tracker, text)
+        assert tracker.extract(text) == text
+
+
+class TestGenerationBudgetController:
+
+    @pytest.fixture
+    def controller(self):
+        return GenerationBudgetController(max_tokens_cap=600)
+
+    def test_younger_children_get_smaller_budgets(self, controller):
+        young = controller.max_tokens_for(StoryPrompt(age=3, language="english", length=10), [], "Introduction")
+        old = controller.max_tokens_for(StoryPrompt(age=11, language="english", length=10), [], "Introduction")
+        assert young < old
+
+    def test_last_paragraph_has_no_choices_budget(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=3)
+        middle = controller.max_tokens_for(prompt, ["a" * 400], "Climax")
+        last = controller.max_tokens_for(prompt, ["a" * 400, "b" * 400], "Climax")
+        assert last < middle
+
+    def test_budget_follows_story_paragraph_lengths(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=10)
+        short = controller.max_tokens_for(prompt, ["a" * 400] * 4, "Rising Action")
+        long = controller.max_tokens_for(prompt, ["a" * 1200] * 4, "Rising Action")
+        assert short < long
+
+    def test_budget_needs_enough_story_paragraphs(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=10)
+        prior = controller.max_tokens_for(prompt, [], "Rising Action")
+        assert controller.max_tokens_for(prompt, ["a" * 200] * 3, "Rising Action") == prior
+
+    def test_budget_has_headroom_and_floor(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=10)
+        # identical paragraphs (std 0) still leave room for a longer one:
+        assert controller.max_tokens_for(prompt, ["a" * 800] * 4, "Rising Action") >= 1.5 * (200 + 60)
+        # very short paragraphs don't shrink the budget below the age floor:
+        tiny = controller.max_tokens_for(prompt, ["a" * 20] * 4, "Rising Action")
+        assert tiny == int((140 * controller.FLOOR_RATIO + 60) * controller.HEADROOM + 20)
+
+    def test_budget_follows_observed_lengths(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=10)
+        prior = controller.max_tokens_for(prompt, [], "Introduction")
+        for _ in range(controller.MIN_SAMPLES):
+            controller.observe(8, "a" * 100)
+        assert controller.max_tokens_for(prompt, [], "Introduction") < prior
+
+    def test_budget_is_capped(self, controller):
+        prompt = StoryPrompt(age=8, language="english", length=10)
+        assert controller.max_tokens_for(prompt, ["a" * 10000] * 4, "Climax") == 600
+
+    def test_report_counts_saved_tokens(self, controller):
+        assert controller.report(max_tokens=300, completion_tokens=120, stopped_early=True) == 180
+        assert controller.report(max_tokens=300, completion_tokens=120, stopped_early=False) == 0
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import os
+import time
+import pytest
+import pytest_asyncio
+from app.core.metrics import metrics
+from app.services.inference_pool import InferencePool, InferencePoolException
+from app.workers.ipc import read_shared, write_shared
+
+
+def fake_worker_main(conn, cancel_event, model_name):
+    """ Torch-free worker following the protocol of app.workers.hf_worker. """
+    conn.send(("ready",))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+        _, job_id, name, size, params = message
+        prompt = read_shared(name, size).decode()
+        if prompt == "crash":
+            os._exit(1)
+        if prompt == "fail":
+            conn.send(("error", job_id, "ValueError: bad prompt"))
+            continue
+        if prompt == "slow":
+            # emulate a decode loop checking the cancel event after each token:
+            while not cancel_event.is_set():
+                time.sleep(0.01)
+        result = {"text": prompt.upper(), "pid": os.getpid(), "cancelled": cancel_event.is_set(), **params}
+        result_name, result_size = write_shared(json.dumps(result).encode())
+        conn.send(("result", job_id, result_name, result_size))
+
+
+@pytest_asyncio.fixture
+async def pool():
+    pool = InferencePool("fake-model", 2, target=fake_worker_main)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+class TestInferencePool:
+    @pytest.mark.asyncio
+    async def test_generate(self, pool):
+        result = await pool.generate("once upon a time", max_new_tokens=10)
+        assert result["text"] == "ONCE UPON A TIME"
+        assert result["max_new_tokens"] == 10
+        assert result["pid"] != os.getpid()
+
+    @pytest.mark.asyncio
+    async def test_jobs_run_in_parallel_workers(self, pool):
+        results = await asyncio.gather(*(pool.generate(f"story {i}") for i in range(6)))
+        assert [result["text"] for result in results] == [f"STORY {i}" for i in range(6)]
+        assert len({result["pid"] for result in results}) == 2
+
+    @pytest.mark.asyncio
+    async def test_worker_error(self, pool):
+        with pytest.raises(InferencePoolException, match="bad prompt"):
+            await pool.generate("fail")
+        # the worker is still usable:
+        assert (await pool.generate("again"))["text"] == "AGAIN"
+
+    @pytest.mark.asyncio
+    async def test_cancel_stops_generation(self, pool):
+        cancelled_before = metrics.get("hf_generation_cancelled")
+        task = asyncio.create_task(pool.generate("slow"))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert metrics.get("hf_generation_cancelled") == cancelled_before + 1
+        # both workers become available again once the cancelled job stopped:
+        results = await asyncio.wait_for(asyncio.gather(pool.generate("a"), pool.generate("b")), timeout=5)
+        assert not any(result["cancelled"] for result in results)
+
+    @pytest.mark.asyncio
+    async def test_crashed_worker_is_restarted(self, pool):
+        restarts_before = metrics.get("inference_worker_restarts")
+        with pytest.raises(InferencePoolException, match="crashed"):
+            await pool.generate("crash")
+        assert metrics.get("inference_worker_restarts") == restarts_before + 1
+        # the replacement worker joins the pool and serves jobs:
+        for _ in range(100):
+            if pool._idle.qsize() == 2:
+                break
+            await asyncio.sleep(0.05)
+        assert pool._idle.qsize() == 2
+        assert all(worker.process.is_alive() for worker in pool._workers)
+        assert (await pool.generate("again"))["text"] == "AGAIN"
+
@@ -0,0 +1,66 @@
+import pytest
+from unittest.mock import patch
+from app.core.config import ModelTier
+from app.services.model_tiering import ModelTierPolicy
+
+TIERS = [
+    ModelTier(model="big", latency_slo=5.0),
+    ModelTier(model="medium", latency_slo=3.0),
+    ModelTier(model="small", latency_slo=2.0),
+]
+
+
+@pytest.fixture
+def policy():
+    return ModelTierPolicy("test", TIERS, max_in_flight=4, recovery_ratio=0.5, min_dwell=0, window=10)
+
+def record_latencies(policy, tier, latency, count=10):
+    with patch("app.services.model_tiering.time.perf_counter", side_effect=[0, latency] * count):
+        for _ in range(count):
+            with policy.track(tier):
+                pass
+
+
+class TestModelTierPolicy:
+
+    def test_starts_with_preferred_model(self, policy):
+        assert policy.select().model == "big"
+
+    def test_degrades_when_latency_exceeds_slo(self, policy):
+        record_latencies(policy, TIERS[0], latency=8.0)
+        assert policy.select().model == "medium"
+
+    def test_degrades_when_too_many_calls_in_flight(self, policy):
+        policy.in_flight = 4
+        assert policy.select().model == "medium"
+
+    def test_recovers_with_hysteresis(self, policy):
+        record_latencies(policy, TIERS[0], latency=8.0)
+        assert policy.select().model == "medium"
+        # within the SLO but above the recovery threshold of the preferred tier: stay on the faster tier
+        record_latencies(policy, TIERS[1], latency=3.0)
+        assert policy.select().model == "medium"
+        # well within the SLO of the preferred tier, even if not of the current one
+        record_latencies(policy, TIERS[1], latency=2.0)
+        assert policy.select().model == "big"
+
+    def test_failed_calls_count_as_slow(self, policy):
+        with patch("app.services.model_tiering.time.perf_counter", side_effect=[0, 0.1] * 10):
+            for _ in range(10):
+                with pytest.raises(TimeoutError):
+                    with policy.track(TIERS[0]):
+                        raise TimeoutError()
+        assert policy.in_flight == 0
+        assert policy.p95("big") == 5.0
+
+    def test_min_dwell_between_switches(self, policy):
+        policy.min_dwell = 3600
+        record_latencies(policy, TIERS[0], latency=8.0)
+        assert policy.select().model == "medium"
+        record_latencies(policy, TIERS[1], latency=8.0)
+        assert policy.select().model == "medium"
+
+    def test_single_tier_never_switches(self):
+        policy = ModelTierPolicy("test", TIERS[:1], max_in_flight=1, recovery_ratio=0.5, min_dwell=0, window=10)
+        policy.in_flight = 10
+        assert policy.select().model == "big"
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import pytest
+from app.core.metrics import metrics
+from app.services.split_generation import ChoicesSpeculator, StreamedStringField
+
+
+def stream(text, chunk_size=3):
+    return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+
+class TestStreamedStringField:
+    def test_reads_value_while_streaming(self):
+        field = StreamedStringField("paragraph")
+        content = '```json\n{"paragraph": "The fox said \\"hi\\". Then\\nit left.", "other": "x"}'
+        values = [field.feed(chunk) for chunk in stream(content, chunk_size=1)]
+        assert values[0] is None
+        assert "The fox said \"hi\"." in values
+        assert field.complete
+        assert field.value == "The fox said \"hi\". Then\nit left."
+
+    def test_partial_escape_sequence(self):
+        field = StreamedStringField("paragraph")
+        assert field.feed('{"paragraph": "Caf\\u00') is None
+        assert field.feed('e9 au lait') == "Café au lait"
+
+    def test_missing_field(self):
+        field = StreamedStringField("paragraph")
+        assert field.feed(json.dumps({"choices": ["a", "b"]})) is None
+
+
+class TestChoicesSpeculator:
+    @pytest.mark.asyncio
+    async def test_speculation_hit(self):
+        calls = []
+
+        async def generate_choices(paragraph):
+            calls.append(paragraph)
+            return [f"after: {paragraph}"]
+
+        hits = metrics.get("split_choices_speculation_hits")
+        speculator = ChoicesSpeculator(generate_choices, min_chars=10)
+        for prefix in ["Once", "Once upon a time.", "Once upon a time. The fox", "Once upon a time. The fox ran."]:
+            speculator.feed(prefix)
+        choices = await speculator.result("Once upon a time. The fox ran.")
+        assert choices == ["after: Once upon a time. The fox ran."]
+        # the first speculative call was replaced (cancelled before running), no extra call at the end:
+        assert calls == ["Once upon a time. The fox ran."]
+        assert metrics.get("split_choices_speculation_hits") == hits + 1
+
+    @pytest.mark.asyncio
+    async def test_speculation_miss(self):
+        started = asyncio.Event()
+        calls = []
+
+        async def generate_choices(paragraph):
+            calls.append(paragraph)
+            started.set()
+            await asyncio.sleep(0.01)
+            return [paragraph]
+
+        speculator = ChoicesSpeculator(generate_choices, min_chars=0)
+        speculator.feed("The fox ran.")
+        await started.wait()
+        choices = await speculator.result("The fox ran. And ran")
+        assert choices == ["The fox ran. And ran"]
+        assert calls == ["The fox ran.", "The fox ran. And ran"]
+
+    @pytest.mark.asyncio
+    async def test_no_speculation_before_min_chars(self):
+        async def generate_choices(paragraph):
+            return [paragraph]
+
+        speculator = ChoicesSpeculator(generate_choices, min_chars=100)
+        speculator.feed("The fox ran.")
+        assert speculator._task is None
+        assert await speculator.result("The fox ran.") == ["The fox ran."]
+
+    @pytest.mark.asyncio
+    async def test_speculation_error_is_raised_on_result(self):
+        async def generate_choices(paragraph):
+            raise ValueError("choices model down")
+
+        speculator = ChoicesSpeculator(generate_choices, min_chars=0)
+        speculator.feed("The fox ran.")
+        with pytest.raises(ValueError, match="choices model down"):
+            await speculator.result("The fox ran.")
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import os
+import time
+import zipfile
+import pytest
+import pytest_asyncio
+from unittest.mock import patch
+from app.core.metrics import metrics
+from app.schemas import StoryExportRequest
+from app.services.story_export import ExportCache, StoryExportException, StoryExporter, export_key
+from app.workers.story_render import render_epub, render_pdf, story_title
+
+
+def make_story(**overrides) -> StoryExportRequest:
+    story = {
+        "prompt": {
+            "age": 6,
+            "language": "french",
+            "length": 3,
+            "characters": [{"name": "Zoé", "type": "enfant", "personality": "curieuse"}, {"name": "Plume", "type": "chat"}],
+        },
+        "history": [
+            "Zoé et Plume entrent dans la forêt… « Tu entends ? » demande Zoé.",
+            "Un hibou leur montre le chemin du cœur de la forêt.",
+            "Ils rentrent à la maison, heureux.",
+        ],
+    }
+    return StoryExportRequest.model_validate({**story, **overrides})
+
+
+@pytest_asyncio.fixture
+async def exporter(tmp_path):
+    exporter = StoryExporter(str(tmp_path / "exports"), cache_max_size=10_000_000, workers=1, max_pending=5)
+    exporter.start()
+    yield exporter
+    exporter.stop()
+
+
+def crash(story, format):
+    os._exit(1)
+
+
+def test_story_title():
+    assert story_title(make_story()) == "Zoé & Plume"
+    assert story_title(make_story(title=" La forêt ")) == "La forêt"
+    assert story_title(make_story(prompt={"age": 6, "language": "english", "length": 3})) == "My story"
+
+
+def test_render_pdf():
+    data = render_pdf(make_story())
+    assert data.startswith(b"%PDF")
+
+
+def test_render_epub():
+    with zipfile.ZipFile(io.BytesIO(render_epub(make_story()))) as epub:
+        assert epub.namelist()[0] == "mimetype"
+        assert epub.read("mimetype") == b"application/epub+zip"
+        chapter = epub.read("OEBPS/story.xhtml").decode()
+        assert "<h1>Zoé &amp; Plume</h1>" in chapter
+        assert "Personnages: Zoé (enfant, curieuse), Plume (chat)" in chapter
+        assert "du cœur de la forêt" in chapter
+
+
+def test_export_key_is_content_addressed():
+    assert export_key(make_story(), "pdf") == export_key(make_story(), "pdf")
+    assert export_key(make_story(), "pdf") != export_key(make_story(), "epub")
+    assert export_key(make_story(), "pdf") != export_key(make_story(title="Autre"), "pdf")
+
+
+class TestExportCache:
+    def test_evicts_least_recently_used(self, tmp_path):
+        cache = ExportCache(str(tmp_path), max_size=250, lease_duration=0)
+        cache.load()
+        cache.put("a", "pdf", b"a" * 100)
+        cache.put("b", "pdf", b"b" * 100)
+        assert cache.get("a", "pdf") is not None     # "b" is now the least recently used
+        cache.put("c", "pdf", b"c" * 100)
+        assert cache.get("b", "pdf") is None
+        assert not os.path.exists(tmp_path / "b.pdf")
+        assert cache.get("a", "pdf") is not None
+        assert cache.get("c", "pdf") is not None
+        assert cache.size == 200
+
+    def test_leased_exports_are_not_evicted(self, tmp_path):
+        cache = ExportCache(str(tmp_path), max_size=150)
+        cache.load()
+        path = cache.put("a", "pdf", b"a" * 100)
+        cache.put("b", "pdf", b"b" * 100)
+        # "a" may still be opened by its response:
+        assert os.path.exists(path)
+        assert cache.size == 200
+        # once the leases expired:
+        with patch("app.services.story_export.time.monotonic", return_value=time.monotonic() + 61):
+            cache.put("c", "pdf", b"c" * 100)
+        assert not os.path.exists(path)
+        assert not os.path.exists(tmp_path / "b.pdf")
+        assert cache.size == 100
+
+    def test_keeps_the_latest_export(self, tmp_path):
+        cache = ExportCache(str(tmp_path), max_size=50)
+        cache.load()
+        path = cache.put("a", "pdf", b"a" * 100)
+        assert cache.get("a", "pdf") == path
+
+    def test_load_indexes_previous_exports(self, tmp_path):
+        cache = ExportCache(str(tmp_path), max_size=1000)
+        cache.load()
+        cache.put("a", "epub", b"a" * 100)
+        (tmp_path / "b.pdf.123.tmp").write_bytes(b"partial")
+
+        cache = ExportCache(str(tmp_path), max_size=1000)
+        cache.load()
+        assert cache.get("a", "epub") is not None
+        assert cache.size == 100
+        assert not os.path.exists(tmp_path / "b.pdf.123.tmp")
+
+
+class TestStoryExporter:
+    @pytest.mark.asyncio
+    async def test_export_is_cached(self, exporter):
+        renders_before = metrics.get("story_export_renders")
+        path = await exporter.export(make_story(), "pdf")
+        with open(path, "rb") as file:
+            assert file.read().startswith(b"%PDF")
+        assert await exporter.export(make_story(), "pdf") == path
+        assert metrics.get("story_export_renders") == renders_before + 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_exports_are_deduplicated(self, exporter):
+        renders_before = metrics.get("story_export_renders")
+        paths = await asyncio.gather(*(exporter.export(make_story(), "epub") for _ in range(5)))
+        assert len(set(paths)) == 1
+        assert metrics.get("story_export_renders") == renders_before + 1
+
+    @pytest.mark.asyncio
+    async def test_broken_pool_is_restarted_once(self, exporter, monkeypatch):
+        monkeypatch.setattr("app.services.story_export.render", crash)
+        broken = exporter._executor
+        results = await asyncio.gather(
+            *(exporter.export(make_story(history=[f"Paragraphe {i}"] * 3), "pdf") for i in range(3)),
+            return_exceptions=True
+        )
+        assert all(isinstance(result, StoryExportException) for result in results)
+        restarted = exporter._executor
+        assert restarted is not broken
+
+        monkeypatch.undo()
+        path = await exporter.export(make_story(), "pdf")
+        assert os.path.exists(path)
+        assert exporter._executor is restarted
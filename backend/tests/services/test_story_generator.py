@@ -1,15 +1,21 @@
 import pytest
 import json
 from app.core.config import settings
-from unittest.mock import AsyncMock, patch
+from app.core.metrics import metrics
+from unittest.mock import AsyncMock, MagicMock, patch
 from app.services.story_generator import (
     build_story_prompt,
     llm_generate_story,
+    llm_get_story_json_huggingface,
     initialize,
+    parse_story_json,
     LLM_SYSTEM_PROMPT,
+    StageManager,
     StoryGeneratorException,
 )
 from app.schemas.story import StoryRequest, StoryPrompt, Character
+from app.services.inference_pool import InferencePoolException
+from app.services.token_ledger import token_ledger
 from openai import OpenAIError
 
 
@@ -94,6 +100,27 @@ class TestBuildStoryPrompt:
         assert "The story has reached the desired length, so end it with a satisfying conclusion." in prompt
 
 
+class TestParseStoryJson:
+    def test_valid_story(self):
+        story = parse_story_json('```{"paragraph": "Once upon a time", "choices": ["Go left", "Go right"]}```', with_choices=True)
+        assert story == {"paragraph": "Once upon a time", "choices": ["Go left", "Go right"]}
+
+    def test_story_ending_has_no_choices(self):
+        assert parse_story_json('{"paragraph": "The end", "choices": []}', with_choices=False)["choices"] == []
+        assert parse_story_json('{"paragraph": "The end"}', with_choices=False)["choices"] == []
+
+    @pytest.mark.parametrize("text", [
+        '{"paragraph": "Cut off',
+        '["Once upon a time"]',
+        '{"paragraph": "", "choices": ["Go left"]}',
+        '{"paragraph": "Once upon a time", "choices": "Go left"}',
+        '{"paragraph": "Once upon a time", "choices": []}',
+    ])
+    def test_invalid_story(self, text):
+        with pytest.raises(StoryGeneratorException):
+            parse_story_json(text, with_choices=True)
+
+
 @pytest.fixture
 def sample_story_request():
     return StoryRequest(
@@ -132,7 +159,7 @@ def mock_ollama_client(mocker):
     mock_client = mocker.patch("httpx.AsyncClient").return_value
     mock_client.__aenter__.return_value = mock_client
     mock_client.__aexit__.return_value = None
-    mock_client.post = AsyncMock()    
+    mock_client.stream = MagicMock()
     return mock_client
 
 VALID_JSON_RESPONSE = {
@@ -140,43 +167,216 @@ VALID_JSON_RESPONSE = {
     "choices": ["Go deeper", "Leave the cave"]
 }
 
-class FakePostResponse():
-    def __init__(self, status_code, response):
+class FakeOpenAIStream():
+    """ Mimics the async stream returned by the OpenAI client when stream=True. """
+    def __init__(self, content, chunk_size=8, usage=None):
+        self.chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        self.usage = usage
+        self.consumed = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.closed = True
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            delta = MagicMock(content=chunk)
+            yield MagicMock(choices=[MagicMock(delta=delta)], usage=None)
+        if self.usage:
+            # with stream_options={"include_usage": True}, the last chunk only holds the usage:
+            yield MagicMock(choices=[], usage=MagicMock(**self.usage))
+
+
+class FakeOllamaStreamResponse():
+    """ Mimics the streamed NDJSON response of the Ollama generate API. """
+    def __init__(self, status_code, response, chunk_size=8):
         self.status_code = status_code
-        self.response = response
+        self.chunks = [response[i:i + chunk_size] for i in range(0, len(response), chunk_size)]
+
+    async def __aenter__(self):
+        return self
 
-    def json(self):
-        return {"response": self.response}
+    async def __aexit__(self, *args):
+        pass
 
     def raise_for_status(self):
         pass
 
+    async def aiter_lines(self):
+        for chunk in self.chunks:
+            yield json.dumps({"response": chunk, "done": False})
+        yield json.dumps({"response": "", "done": True})
+
+
+HF_RESULT = {
+    "text": json.dumps(VALID_JSON_RESPONSE),
+    "prompt_tokens": 512,
+    "completion_tokens": 42,
+    "stopped_early": True,
+    "cancelled": False,
+    "time_to_first_token_ms": 12.5,
+    "decode_ms": 2100.0,
+    "assisted": False,
+    "main_model_steps": 42,
+    "draft_tokens": 0,
+}
+
+STAGE_PLAN = {"Introduction": 1, "Rising Action": 2, "Climax": 1, "Resolution": 1}
+MAX_TOKENS = 256
+
+@pytest.fixture
+def fixed_budget(mocker):
+    """ Fixture to pin the adaptive output token budget. """
+    return mocker.patch(
+        "app.services.story_generator.generation_budget.max_tokens_for",
+        return_value=MAX_TOKENS
+    )
+
 
 class TestLLMGenerateStory:
     
     @pytest.mark.asyncio
     @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
-    async def test_llm_generate_story_openai(self, mocker, mock_openai_client, sample_story_request):
-        mock_openai_client.chat.completions.create.return_value = mocker.Mock(
-            choices=[mocker.Mock(message=mocker.Mock(content=json.dumps(VALID_JSON_RESPONSE)))]
-        )
-        paragraph, choices = await llm_generate_story(sample_story_request)
+    async def test_llm_generate_story_openai(self, mock_openai_client, fixed_budget, sample_story_request):
+        stream = FakeOpenAIStream(json.dumps(VALID_JSON_RESPONSE))
+        mock_openai_client.chat.completions.create.return_value = stream
+        sample_story_request.stage_plan = STAGE_PLAN
+        step = await llm_generate_story(sample_story_request)
         
         expected_prompt = build_story_prompt(
             sample_story_request.prompt,
             sample_story_request.history,
-            sample_story_request.choice
+            sample_story_request.choice,
+            StageManager(5, STAGE_PLAN).get_stage_guidance(len(sample_story_request.history))
         )
         mock_openai_client.chat.completions.create.assert_called_once_with(
             model=settings.LLM_OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": LLM_SYSTEM_PROMPT},
                 {"role": "user", "content": expected_prompt}
-            ]
+            ],
+            max_tokens=MAX_TOKENS,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        assert paragraph == VALID_JSON_RESPONSE["paragraph"]
-        assert choices == VALID_JSON_RESPONSE["choices"]
+        assert step.paragraph == VALID_JSON_RESPONSE["paragraph"]
+        assert step.choices == VALID_JSON_RESPONSE["choices"]
+        assert step.stage_plan == STAGE_PLAN
+        assert step.model == settings.LLM_OPENAI_MODEL
+        assert stream.closed
         
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    async def test_openai_stops_once_json_is_complete(self, mock_openai_client, sample_story_request):
+        content = "```json\n" + json.dumps(VALID_JSON_RESPONSE) + "\n```\nI hope you enjoy this story! " * 10
+        stream = FakeOpenAIStream(content)
+        mock_openai_client.chat.completions.create.return_value = stream
+        early_stops = metrics.get("llm_early_stops")
+        
+        step = await llm_generate_story(sample_story_request)
+        assert step.paragraph == VALID_JSON_RESPONSE["paragraph"]
+        assert step.choices == VALID_JSON_RESPONSE["choices"]
+        assert stream.consumed < len(stream.chunks)
+        assert stream.closed
+        assert metrics.get("llm_early_stops") == early_stops + 1
+
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    async def test_openai_token_usage_is_tracked(self, mock_openai_client, fixed_budget, sample_story_request):
+        # the model stops right after the JSON object, so the usage chunk is read:
+        mock_openai_client.chat.completions.create.return_value = FakeOpenAIStream(
+            json.dumps(VALID_JSON_RESPONSE),
+            usage={"prompt_tokens": 321, "completion_tokens": 17}
+        )
+        with token_ledger.track() as usage:
+            await llm_generate_story(sample_story_request)
+        assert (usage.prompt_tokens, usage.completion_tokens) == (321, 17)
+
+        # chatter after the JSON object: we stop reading, the prompt tokens are estimated
+        content = json.dumps(VALID_JSON_RESPONSE) + "\nI hope you enjoy this story! " * 10
+        mock_openai_client.chat.completions.create.return_value = FakeOpenAIStream(
+            content,
+            usage={"prompt_tokens": 321, "completion_tokens": 99}
+        )
+        with token_ledger.track() as usage:
+            await llm_generate_story(sample_story_request)
+        assert usage.prompt_tokens > 0 and usage.prompt_tokens != 321
+        assert usage.completion_tokens == len(FakeOpenAIStream(json.dumps(VALID_JSON_RESPONSE)).chunks)
+
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    @patch("app.services.story_generator.settings.STORY_SPLIT_GENERATION", True)
+    @patch("app.services.story_generator.settings.LLM_CHOICES_METHOD", "openai")
+    @patch("app.services.story_generator.settings.LLM_CHOICES_MODEL", "small-model")
+    @patch("app.services.story_generator.SPECULATION_START_RATIO", 0)
+    async def test_split_generation(self, mock_openai_client, fixed_budget, sample_story_request):
+        paragraph_stream = FakeOpenAIStream(json.dumps({"paragraph": VALID_JSON_RESPONSE["paragraph"]}))
+        choices_stream = FakeOpenAIStream(json.dumps(VALID_JSON_RESPONSE["choices"]))
+
+        async def create(model, messages, **kwargs):
+            return choices_stream if model == "small-model" else paragraph_stream
+
+        mock_openai_client.chat.completions.create.side_effect = create
+        hits = metrics.get("split_choices_speculation_hits")
+        step = await llm_generate_story(sample_story_request)
+
+        assert step.paragraph == VALID_JSON_RESPONSE["paragraph"]
+        assert step.choices == VALID_JSON_RESPONSE["choices"]
+        assert step.model == settings.LLM_OPENAI_MODEL
+        calls = mock_openai_client.chat.completions.create.call_args_list
+        assert len(calls) == 2
+        main_prompt = calls[0].kwargs["messages"][1]["content"]
+        assert "choices" not in main_prompt
+        choices_prompt = calls[1].kwargs["messages"][1]["content"]
+        assert VALID_JSON_RESPONSE["paragraph"] in choices_prompt
+        # the choices were requested while the paragraph was being streamed:
+        assert metrics.get("split_choices_speculation_hits") == hits + 1
+
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    @patch("app.services.story_generator.settings.STORY_SPLIT_GENERATION", True)
+    @patch("app.services.story_generator.settings.LLM_CHOICES_METHOD", "openai")
+    async def test_split_generation_invalid_choices_raises(self, mock_openai_client, fixed_budget, sample_story_request):
+        streams = iter([
+            FakeOpenAIStream(json.dumps({"paragraph": VALID_JSON_RESPONSE["paragraph"]})),
+            FakeOpenAIStream("Sorry, I can't do that."),
+        ])
+        mock_openai_client.chat.completions.create.side_effect = lambda **kwargs: next(streams)
+        with pytest.raises(StoryGeneratorException, match="Invalid JSON from choices LLM"):
+            await llm_generate_story(sample_story_request)
+
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    async def test_truncated_response_is_retried_without_budget(self, mock_openai_client, fixed_budget, sample_story_request):
+        content = json.dumps(VALID_JSON_RESPONSE)
+        streams = iter([
+            FakeOpenAIStream(content[:40], usage={"prompt_tokens": 500, "completion_tokens": MAX_TOKENS}),
+            FakeOpenAIStream(content)
+        ])
+        mock_openai_client.chat.completions.create.side_effect = lambda **kwargs: next(streams)
+        retries = metrics.get("llm_truncation_retries")
+
+        step = await llm_generate_story(sample_story_request)
+        assert step.paragraph == VALID_JSON_RESPONSE["paragraph"]
+        calls = mock_openai_client.chat.completions.create.call_args_list
+        assert [call.kwargs["max_tokens"] for call in calls] == [MAX_TOKENS, settings.LLM_MAX_OUTPUT_TOKENS]
+        assert metrics.get("llm_truncation_retries") == retries + 1
+
+    @pytest.mark.asyncio
+    @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
+    async def test_invalid_response_within_budget_is_not_retried(self, mock_openai_client, fixed_budget, sample_story_request):
+        mock_openai_client.chat.completions.create.return_value = FakeOpenAIStream("Once upon a time, in a cave")
+        retries = metrics.get("llm_truncation_retries")
+
+        with pytest.raises(StoryGeneratorException, match="Invalid JSON from LLM"):
+            await llm_generate_story(sample_story_request)
+        assert mock_openai_client.chat.completions.create.call_count == 1
+        assert metrics.get("llm_truncation_retries") == retries
+
     @pytest.mark.asyncio
     @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
     async def test_openai_error_raises(self, mock_openai_client, sample_story_request):
@@ -194,40 +394,77 @@ class TestLLMGenerateStory:
     @pytest.mark.asyncio
     @patch("app.services.story_generator.settings.LLM_METHOD", "openai")
     async def test_openai_invalid_json_raises(self, mocker, mock_openai_client, sample_story_request):
-        mock_openai_client.chat.completions.create.return_value = mocker.Mock(
-            choices=[mocker.Mock(message=mocker.Mock(content="invalid json"))]
-        )
+        mock_openai_client.chat.completions.create.return_value = FakeOpenAIStream("invalid json")
         with pytest.raises(StoryGeneratorException, match="Invalid JSON from LLM"):
             await llm_generate_story(sample_story_request)
     
     
     @pytest.mark.asyncio
     @patch("app.services.story_generator.settings.LLM_METHOD", "ollama")
-    async def test_llm_generate_story_ollama(self, mock_ollama_client, sample_story_request):
-        mock_ollama_client.post.return_value = FakePostResponse(
+    async def test_llm_generate_story_ollama(self, mock_ollama_client, fixed_budget, sample_story_request):
+        mock_ollama_client.stream.return_value = FakeOllamaStreamResponse(
             status_code=200,
             response=json.dumps(VALID_JSON_RESPONSE)
         )
-        paragraph, choices = await llm_generate_story(sample_story_request)
+        sample_story_request.stage_plan = STAGE_PLAN
+        step = await llm_generate_story(sample_story_request)
         
         expected_prompt = build_story_prompt(
             sample_story_request.prompt,
             sample_story_request.history,
-            sample_story_request.choice
+            sample_story_request.choice,
+            StageManager(5, STAGE_PLAN).get_stage_guidance(len(sample_story_request.history))
         )
-        mock_ollama_client.post.assert_called_once_with(
+        mock_ollama_client.stream.assert_called_once_with(
+            "POST",
             settings.LLM_OLLAMA_API_URL,
                 json={
                     "model": settings.LLM_OLLAMA_MODEL,
                     "system": LLM_SYSTEM_PROMPT,
                     "prompt": expected_prompt,
-                    "stream": False
+                    "stream": True,
+                    "options": {"num_predict": MAX_TOKENS}
                 },
                 headers={"Content-Type": "application/json"},
                 timeout=60
         )
-        assert paragraph == VALID_JSON_RESPONSE["paragraph"]
-        assert choices == VALID_JSON_RESPONSE["choices"]
+        assert step.paragraph == VALID_JSON_RESPONSE["paragraph"]
+        assert step.choices == VALID_JSON_RESPONSE["choices"]
+        assert step.stage_plan == STAGE_PLAN
         
-    # TODO: write tests for HuggingFace LLM, once it's working properly
+    @pytest.mark.asyncio
+    async def test_huggingface_generates_in_worker_pool(self, mocker):
+        """ Generation is delegated to the inference worker processes. """
+        pool = MagicMock()
+        pool.generate = AsyncMock(return_value=HF_RESULT)
+        mocker.patch("app.services.story_generator.inference_pool", pool)
+        completion = await llm_get_story_json_huggingface("prompt", MAX_TOKENS)
+        pool.generate.assert_awaited_once_with(
+            f"{LLM_SYSTEM_PROMPT}\n\nprompt",
+            max_new_tokens=MAX_TOKENS,
+            draft_model=None
+        )
+        assert json.loads(completion.text) == VALID_JSON_RESPONSE
+        assert completion.completion_tokens == 42
+        assert completion.stopped_early
+
+    @pytest.mark.asyncio
+    async def test_huggingface_assisted_decoding(self, mocker):
+        pool = MagicMock()
+        pool.generate = AsyncMock(return_value={**HF_RESULT, "assisted": True, "main_model_steps": 14, "draft_tokens": 40})
+        mocker.patch("app.services.story_generator.inference_pool", pool)
+        mocker.patch("app.services.story_generator.assisted_decoding.pick_draft_model", return_value="draft-model")
+        observe = mocker.patch("app.services.story_generator.assisted_decoding.observe")
+        await llm_get_story_json_huggingface("prompt", MAX_TOKENS)
+        assert pool.generate.call_args.kwargs["draft_model"] == "draft-model"
+        observe.assert_called_once_with(pool.generate.return_value)
+
+    @pytest.mark.asyncio
+    async def test_huggingface_worker_error(self, mocker):
+        pool = MagicMock()
+        pool.generate = AsyncMock(side_effect=InferencePoolException("worker crashed"))
+        mocker.patch("app.services.story_generator.inference_pool", pool)
+        with pytest.raises(StoryGeneratorException, match="worker crashed"):
+            await llm_get_story_json_huggingface("prompt", MAX_TOKENS)
 
+    # TODO: write more tests for HuggingFace LLM, once it's working properly
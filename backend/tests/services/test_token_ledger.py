@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from datetime import datetime, timezone
+from app.core.config import settings
+from app.schemas import StoryPrompt
+from app.services.generation_budget import GenerationBudgetController, estimate_tokens
+from app.services.story_generator import LLM_SYSTEM_PROMPT, StageManager, build_story_prompt
+from app.services.token_ledger import (
+    TokenBudgetExceededException,
+    TokenLedger,
+    TokenUsage,
+    story_key,
+)
+
+
+def make_ledger(tmp_path, **overrides) -> TokenLedger:
+    params = dict(story_budget=1000, client_budget=1500, batch_size=100, flush_interval=60, retention_days=30)
+    return TokenLedger(str(tmp_path / "tokens.db"), **{**params, **overrides})
+
+
+@pytest_asyncio.fixture
+async def ledger(tmp_path):
+    ledger = make_ledger(tmp_path)
+    await ledger.start()
+    yield ledger
+    await ledger.stop()
+
+
+def today():
+    return datetime.now(timezone.utc).date()
+
+
+def test_story_key():
+    prompt = StoryPrompt(age=8, language="english", length=10)
+    key = story_key(prompt, "Once upon a time")
+    assert len(key) == 16
+    assert key == story_key(StoryPrompt(age=8, language="english", length=10), "Once upon a time")
+    assert key != story_key(prompt, "Once upon a time, again")
+
+
+def test_track_counts_nested_tasks(tmp_path):
+    ledger = make_ledger(tmp_path)
+
+    async def call_llm():
+        ledger.count(100, 20)
+
+    async def handle_request():
+        with ledger.track() as usage:
+            ledger.count(300, 50)
+            # eg: the speculative choices calls of split generation
+            await asyncio.create_task(call_llm())
+        return usage
+
+    usage = asyncio.run(handle_request())
+    assert (usage.prompt_tokens, usage.completion_tokens) == (400, 70)
+    # outside of a tracked request, counting is a no-op:
+    ledger.count(1, 1)
+
+
+@pytest.mark.parametrize("length", [3, 10, 60])
+def test_default_story_budget_fits_a_full_story(tmp_path, length):
+    """ A whole story of 12 y.o. sized paragraphs, each request sending the story so far. """
+    ledger = make_ledger(tmp_path, story_budget=settings.TOKEN_BUDGET_PER_STORY)
+    prompt = StoryPrompt(age=12, language="english", length=length)
+    paragraph_tokens = dict(GenerationBudgetController.AGE_PRIOR_TOKENS)[12]
+    paragraph = "word " * int(paragraph_tokens * 4 / 5)
+    stage_manager = StageManager(length, None)
+    history = []
+    used = 0
+    for index in range(length):
+        story_prompt = build_story_prompt(prompt, history, "Choice 1" if history else None, stage_manager.get_stage_guidance(index))
+        completion_tokens = paragraph_tokens + GenerationBudgetController.CHOICES_TOKENS + GenerationBudgetController.JSON_OVERHEAD_TOKENS
+        used += estimate_tokens(LLM_SYSTEM_PROMPT + story_prompt) + completion_tokens
+        history.append(paragraph)
+    assert used < ledger.story_budget_for(length)
+
+
+class TestTokenLedger:
+    @pytest.mark.asyncio
+    async def test_budgets(self, ledger):
+        ledger.check("1.2.3.4", "story-a")
+        ledger.record("1.2.3.4", "story-a", "model", TokenUsage(800, 200))
+        with pytest.raises(TokenBudgetExceededException, match="story"):
+            ledger.check("1.2.3.4", "story-a")
+        # shorter stories get smaller budgets:
+        assert ledger.story_budget_for(10) < ledger.story_budget_for(20) < ledger.story_budget_for(60) == 1000
+        # a new story of the same client is still allowed, until the client budget is used up:
+        ledger.check("1.2.3.4", "story-b")
+        ledger.record("1.2.3.4", "story-b", "model", TokenUsage(400, 100))
+        with pytest.raises(TokenBudgetExceededException, match="Daily token budget"):
+            ledger.check("1.2.3.4", "story-c")
+        ledger.check("5.6.7.8", None)
+
+    def test_disabled_budgets(self, tmp_path):
+        ledger = make_ledger(tmp_path, story_budget=0, client_budget=0)
+        ledger.record("1.2.3.4", "story-a", "model", TokenUsage(100_000, 1000))
+        ledger.check("1.2.3.4", "story-a")
+
+    @pytest.mark.asyncio
+    async def test_usage_is_aggregated_in_batches(self, ledger):
+        for _ in range(3):
+            ledger.record("1.2.3.4", "story-a", "model", TokenUsage(300, 50))
+        ledger.record("5.6.7.8", "story-b", "model", TokenUsage(100, 20))
+        # nothing is written until the next batch:
+        assert ledger.query("client", today()) == []
+        await ledger.flush()
+
+        clients = ledger.query("client", today())
+        assert [(item.key, item.total_tokens, item.requests) for item in clients] == [("1.2.3.4", 1050, 3), ("5.6.7.8", 120, 1)]
+        stories = ledger.query("story", today(), key="story-b")
+        assert [(item.prompt_tokens, item.completion_tokens) for item in stories] == [(100, 20)]
+        assert ledger._connection.execute("SELECT COUNT(*) FROM token_requests").fetchone()[0] == 4
+
+    @pytest.mark.asyncio
+    async def test_full_batch_is_written_right_away(self, tmp_path):
+        ledger = make_ledger(tmp_path, batch_size=2)
+        await ledger.start()
+        try:
+            ledger.record("1.2.3.4", "story-a", "model", TokenUsage(300, 50))
+            ledger.record("1.2.3.4", "story-a", "model", TokenUsage(300, 50))
+            for _ in range(50):
+                await asyncio.sleep(0.01)
+                if ledger.query("client", today()):
+                    break
+            assert ledger.query("client", today())[0].total_tokens == 700
+        finally:
+            await ledger.stop()
+
+    @pytest.mark.asyncio
+    async def test_totals_survive_restarts(self, tmp_path):
+        ledger = make_ledger(tmp_path)
+        await ledger.start()
+        ledger.record("1.2.3.4", "story-a", "model", TokenUsage(900, 100))
+        # pending records are written on stop:
+        await ledger.stop()
+
+        ledger = make_ledger(tmp_path)
+        await ledger.start()
+        try:
+            assert ledger.used("story", "story-a") == 1000
+            with pytest.raises(TokenBudgetExceededException):
+                ledger.check("1.2.3.4", "story-a")
+        finally:
+            await ledger.stop()